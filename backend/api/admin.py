@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Artist, Album, Song, Playlist
+from .models import Artist, Album, Song, Playlist, ConversationSummary
 
 # Register your models here.
 admin.site.register(Artist)
 admin.site.register(Album)
 admin.site.register(Song)
-admin.site.register(Playlist)
\ No newline at end of file
+admin.site.register(Playlist)
+admin.site.register(ConversationSummary)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""Bulk assignment of songs to an album.
+
+``set_songs`` replaces an album's song list in one transaction: the album
+row is locked first, so two reassignments of the same album run one after
+the other, and the songs are moved with two set-based UPDATEs. Only ids
+are read; the requested songs are validated with a single COUNT. The
+search index and playlist covers of the moved songs are refreshed after
+commit, once the album lock is released.
+"""
+from django.db import transaction
+
+from .models import Album, PlaylistEntry, Song
+from . import playlists, search
+from .response_cache import invalidate as invalidate_catalog_cache
+
+
+class SongsUnavailable(Exception):
+    """Some requested songs do not exist or belong to another album."""
+
+
+def set_songs(album_id, song_ids):
+    """Make ``song_ids`` the songs of the album.
+
+    Songs that leave the album are unassigned; new ones must exist and be
+    unassigned, otherwise ``SongsUnavailable`` is raised and nothing
+    changes. Returns a summary: album id, resulting song count and how
+    many songs were added and removed.
+    """
+    song_ids = set(song_ids)
+    with transaction.atomic():
+        Album.objects.select_for_update().values_list('pk', flat=True).get(pk=album_id)
+        current = set(Song.objects.filter(album_id=album_id).values_list('pk', flat=True))
+        added, removed = song_ids - current, current - song_ids
+        if added and Song.objects.filter(pk__in=added, album__isnull=True).count() != len(added):
+            raise SongsUnavailable
+        if removed:
+            Song.objects.filter(pk__in=removed, album_id=album_id).update(album=None)
+        # Điều kiện album IS NULL lặp lại trong UPDATE: bài vừa được album khác
+        # nhận sau lần đếm sẽ làm số dòng lệch và rollback toàn bộ
+        if added and Song.objects.filter(pk__in=added, album__isnull=True).update(album_id=album_id) != len(added):
+            raise SongsUnavailable
+        changed = added | removed
+        if changed:
+            # .update() bỏ qua signal; chạy sau commit để không giữ khóa album
+            transaction.on_commit(lambda: _songs_moved(changed))
+    return {'album': album_id, 'song_count': len(song_ids), 'added': len(added), 'removed': len(removed)}
+
+
+def _songs_moved(song_ids):
+    search.reindex_songs(song_ids)
+    # Đổi album chỉ ảnh hưởng ảnh bìa: không đếm lại số bài/thời lượng
+    playlists.touch_covers(PlaylistEntry.objects.filter(song_id__in=song_ids).order_by().values_list('playlist_id', flat=True))
+    invalidate_catalog_cache('song')
@@ -0,0 +1,185 @@
+"""Read an audio file's duration from its container header.
+
+Only header bytes are read (plus the last Ogg page for Ogg streams); the
+audio itself is never decoded. Supported: MP3 (Xing/Info/VBRI or CBR),
+WAV, FLAC, MP4/M4A and Ogg Vorbis/Opus. ``probe_duration`` returns
+``None`` for anything it cannot recognize.
+"""
+import struct
+from datetime import timedelta
+
+SYNC_SEARCH_BYTES = 64 * 1024
+OGG_TAIL_BYTES = 64 * 1024
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def _size(f):
+    f.seek(0, 2)
+    return f.tell()
+
+
+def _read_at(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
+
+
+def _parse_mp3_header(header):
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((header[1] >> 3) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        samples, length = 576, 72 * bitrate // sample_rate + padding
+    else:
+        samples, length = 1152, 144 * bitrate // sample_rate + padding
+    return {
+        'version': version, 'bitrate': bitrate, 'sample_rate': sample_rate,
+        'samples': samples, 'length': length, 'mono': header[3] >> 6 == 3,
+    }
+
+
+def _probe_mp3(f, size):
+    head = _read_at(f, 0, 10)
+    start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        start = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+        if head[5] & 0x10:
+            start += 10
+    data = _read_at(f, start, SYNC_SEARCH_BYTES)
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF:
+            continue
+        frame = _parse_mp3_header(data[i:i + 4])
+        if frame is None:
+            continue
+        next_header = data[i + frame['length']:i + frame['length'] + 4]
+        if len(next_header) == 4 and _parse_mp3_header(next_header) is None:
+            continue
+        side_info = (17 if frame['mono'] else 32) if frame['version'] == 1 else (9 if frame['mono'] else 17)
+        xing = data[i + 4 + side_info:i + 4 + side_info + 12]
+        if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 1:
+            frames = struct.unpack('>I', xing[8:12])[0]
+            return frames * frame['samples'] / frame['sample_rate']
+        vbri = data[i + 36:i + 36 + 18]
+        if vbri[:4] == b'VBRI' and len(vbri) == 18:
+            frames = struct.unpack('>I', vbri[14:18])[0]
+            return frames * frame['samples'] / frame['sample_rate']
+        return (size - start - i) * 8 / frame['bitrate']
+    return None
+
+
+def _probe_wav(f, size):
+    offset, byte_rate = 12, None
+    while offset + 8 <= size:
+        chunk_id, chunk_size = struct.unpack('<4sI', _read_at(f, offset, 8))
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack('<I', _read_at(f, offset + 16, 4))[0]
+        elif chunk_id == b'data':
+            return chunk_size / byte_rate if byte_rate else None
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _probe_flac(f, size):
+    block = _read_at(f, 4, 4 + 34)
+    if len(block) < 38 or block[0] & 0x7F != 0:
+        return None
+    packed = int.from_bytes(block[4 + 10:4 + 18], 'big')
+    sample_rate, total_samples = packed >> 44, packed & ((1 << 36) - 1)
+    return total_samples / sample_rate if sample_rate and total_samples else None
+
+
+def _iter_atoms(f, start, end):
+    offset = start
+    while offset + 8 <= end:
+        atom_size, atom_type = struct.unpack('>I4s', _read_at(f, offset, 8))
+        header = 8
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif atom_size == 0:
+            atom_size = end - offset
+        if atom_size < header:
+            return
+        yield atom_type, offset + header, offset + atom_size
+        offset += atom_size
+
+
+def _probe_mp4(f, size):
+    for atom_type, body, end in _iter_atoms(f, 0, size):
+        if atom_type != b'moov':
+            continue
+        for child_type, child_body, _ in _iter_atoms(f, body, end):
+            if child_type != b'mvhd':
+                continue
+            version = _read_at(f, child_body, 1)[0]
+            if version == 1:
+                timescale, duration = struct.unpack('>IQ', _read_at(f, child_body + 20, 12))
+            else:
+                timescale, duration = struct.unpack('>II', _read_at(f, child_body + 12, 8))
+            return duration / timescale if timescale else None
+    return None
+
+
+def _probe_ogg(f, size):
+    first_page = _read_at(f, 0, 512)
+    segments = first_page[26] if len(first_page) > 27 else 0
+    packet = first_page[27 + segments:]
+    if packet[:7] == b'\x01vorbis':
+        sample_rate, pre_skip = struct.unpack('<I', packet[12:16])[0], 0
+    elif packet[:8] == b'OpusHead':
+        sample_rate, pre_skip = 48000, struct.unpack('<H', packet[10:12])[0]
+    else:
+        return None
+    tail = _read_at(f, max(size - OGG_TAIL_BYTES, 0), OGG_TAIL_BYTES)
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0 or not sample_rate:
+        return None
+    granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+    return max(granule - pre_skip, 0) / sample_rate
+
+
+def probe_duration(fileobj):
+    """Return the duration of an audio file object as a timedelta, or None.
+
+    The file position is restored afterwards so uploads can still be saved.
+    """
+    position = fileobj.tell()
+    try:
+        size = _size(fileobj)
+        magic = _read_at(fileobj, 0, 12)
+        if magic[:4] == b'RIFF' and magic[8:12] == b'WAVE':
+            seconds = _probe_wav(fileobj, size)
+        elif magic[:4] == b'fLaC':
+            seconds = _probe_flac(fileobj, size)
+        elif magic[4:8] == b'ftyp':
+            seconds = _probe_mp4(fileobj, size)
+        elif magic[:4] == b'OggS':
+            seconds = _probe_ogg(fileobj, size)
+        else:
+            seconds = _probe_mp3(fileobj, size)
+    except (struct.error, IndexError, OSError, ZeroDivisionError):
+        seconds = None
+    finally:
+        fileobj.seek(position)
+    if not seconds:
+        return None
+    return timedelta(seconds=round(seconds))
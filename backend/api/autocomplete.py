@@ -0,0 +1,133 @@
+"""In-memory prefix index for search-as-you-type.
+
+Song titles, artist names and album titles are kept in a sorted array of
+normalized keys, one key per word start, so a prefix lookup is a bisect
+plus a short scan. The index is loaded on first use and then maintained by
+the signals in ``api.signals``; lookups never touch the database.
+"""
+import threading
+from bisect import bisect_left, insort
+
+from .models import Artist, Album, Song
+from .search import tokenize
+
+KINDS = {
+    'song': (Song, 'title'),
+    'artist': (Artist, 'name'),
+    'album': (Album, 'title'),
+}
+
+
+def word_keys(label):
+    tokens = tokenize(label)
+    return {' '.join(tokens[i:]) for i in range(len(tokens))}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._labels = {}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def load(self, items):
+        """Fill an empty index from ``(kind, obj_id, label)`` items with one sort."""
+        keys = []
+        for kind, obj_id, label in items:
+            entry_keys = word_keys(label)
+            keys.extend((key, kind, obj_id) for key in entry_keys)
+            self._labels[kind, obj_id] = (label, entry_keys)
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+
+    def put(self, kind, obj_id, label):
+        with self._lock:
+            self._discard(kind, obj_id)
+            keys = word_keys(label)
+            for key in keys:
+                insort(self._keys, (key, kind, obj_id))
+            self._labels[kind, obj_id] = (label, keys)
+
+    def discard(self, kind, obj_id):
+        with self._lock:
+            self._discard(kind, obj_id)
+
+    def _discard(self, kind, obj_id):
+        entry = self._labels.pop((kind, obj_id), None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            i = bisect_left(self._keys, (key, kind, obj_id))
+            if i < len(self._keys) and self._keys[i] == (key, kind, obj_id):
+                del self._keys[i]
+
+    def complete(self, prefix, limit=10):
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, kind, obj_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if (kind, obj_id) not in seen:
+                    seen.add((kind, obj_id))
+                    results.append({'type': kind, 'id': obj_id, 'label': self._labels[kind, obj_id][0]})
+                i += 1
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PrefixIndex()
+                # Sắp xếp một lần thay vì insort từng key (O(n²) khi nạp lần đầu)
+                index.load(
+                    (kind, obj_id, label)
+                    for kind, (model, field) in KINDS.items()
+                    for obj_id, label in model.objects.values_list('id', field).iterator(chunk_size=2000)
+                )
+                _index = index
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def kind_for(model):
+    for kind, (kind_model, field) in KINDS.items():
+        if model is kind_model:
+            return kind, field
+    return None, None
+
+
+def update(instance):
+    if _index is None:
+        return
+    kind, field = kind_for(type(instance))
+    _index.put(kind, instance.id, getattr(instance, field))
+
+
+def remove(instance):
+    if _index is None:
+        return
+    kind, _ = kind_for(type(instance))
+    _index.discard(kind, instance.id)
+
+
+def complete(prefix, limit=10):
+    return get_index().complete(prefix, limit)
@@ -0,0 +1,109 @@
+"""Channel layers that can deliver one message to several groups at once.
+
+``group_send_many`` resolves the members of every target group, removes
+duplicate channels (a user chatting with themselves, or a channel in both
+groups) and sends the message once per channel. The Redis layer does this
+in one pipelined round trip for the group lookups and one for the delivery,
+instead of four round trips per group with ``group_send``.
+"""
+import asyncio
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+try:
+    from channels_redis.core import RedisChannelLayer
+except ImportError:  # pragma: no cover - chỉ cần khi dùng Redis
+    RedisChannelLayer = None
+
+
+async def group_send_many(channel_layer, groups, message):
+    """Send ``message`` to every group in ``groups``, each channel once."""
+    groups = list(dict.fromkeys(groups))
+    send_many = getattr(channel_layer, 'group_send_many', None)
+    if send_many is not None:
+        await send_many(groups, message)
+    else:
+        for group in groups:
+            await channel_layer.group_send(group, message)
+
+
+class MultiGroupInMemoryChannelLayer(InMemoryChannelLayer):
+    async def group_send_many(self, groups, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        for group in groups:
+            self.require_valid_group_name(group)
+        self._clean_expired()
+        channels = {}
+        for group in groups:
+            channels.update(self.groups.get(group, {}))
+        for channel in channels:
+            try:
+                await self.send(channel, message)
+            except ChannelFull:
+                pass
+
+
+if RedisChannelLayer is not None:
+
+    class MultiGroupRedisChannelLayer(RedisChannelLayer):
+        # Giống script trong RedisChannelLayer.group_send
+        group_send_lua = """
+            local over_capacity = 0
+            local current_time = ARGV[#ARGV - 1]
+            local expiry = ARGV[#ARGV]
+            for i=1,#KEYS do
+                if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+                    redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+                    redis.call('EXPIRE', KEYS[i], expiry)
+                else
+                    over_capacity = over_capacity + 1
+                end
+            end
+            return over_capacity
+        """
+
+        async def _group_channels(self, groups):
+            by_connection = {}
+            for group in groups:
+                assert self.require_valid_group_name(group), "Group name not valid"
+                by_connection.setdefault(self.consistent_hash(group), []).append(group)
+
+            async def lookup(index, shard_groups):
+                pipe = self.connection(index).pipeline()
+                for group in shard_groups:
+                    key = self._group_key(group)
+                    pipe.zremrangebyscore(key, min=0, max=int(time.time()) - self.group_expiry)
+                    pipe.zrange(key, 0, -1)
+                return (await pipe.execute())[1::2]
+
+            results = await asyncio.gather(*(lookup(i, g) for i, g in by_connection.items()))
+            channels = {}
+            for members_per_group in results:
+                for members in members_per_group:
+                    for name in members:
+                        channels[name.decode('utf8')] = None
+            return list(channels)
+
+        async def group_send_many(self, groups, message):
+            channel_names = await self._group_channels(groups)
+            if not channel_names:
+                return
+            (
+                connection_to_channel_keys,
+                channel_keys_to_message,
+                channel_keys_to_capacity,
+            ) = self._map_channel_keys_to_connection(channel_names, message)
+
+            async def deliver(index, channel_keys):
+                pipe = self.connection(index).pipeline()
+                for key in channel_keys:
+                    pipe.zremrangebyscore(key, min=0, max=int(time.time()) - int(self.expiry))
+                args = [channel_keys_to_message[key] for key in channel_keys]
+                args += [channel_keys_to_capacity[key] for key in channel_keys]
+                args += [time.time(), self.expiry]
+                pipe.eval(self.group_send_lua, len(channel_keys), *channel_keys, *args)
+                await pipe.execute()
+
+            await asyncio.gather(*(deliver(i, keys) for i, keys in connection_to_channel_keys.items()))
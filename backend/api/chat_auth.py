@@ -0,0 +1,96 @@
+"""JWT authentication for websocket connections.
+
+``JWTAuthMiddleware`` reads ``?token=<access token>`` from the query string
+and puts the matching user in ``scope['user']``. Both the token validation
+result and the user row are cached for ``CHAT_AUTH_CACHE_TTL`` seconds, so
+a reconnect storm (e.g. after a deploy) costs neither signature checks nor
+database round trips for clients that were just seen. Unlike
+``AuthMiddlewareStack`` it never touches the session store.
+"""
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .chat_writer import LRUCache
+
+
+class TTLCache(LRUCache):
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key, value, ttl):
+        super().set(key, (time.monotonic() + ttl, value))
+
+
+token_cache = TTLCache(getattr(settings, 'CHAT_AUTH_CACHE_SIZE', 10000))
+user_cache = TTLCache(getattr(settings, 'CHAT_AUTH_CACHE_SIZE', 10000))
+
+
+def cache_ttl():
+    return getattr(settings, 'CHAT_AUTH_CACHE_TTL', 30)
+
+
+def query_param(scope, name):
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    values = params.get(name)
+    return values[0] if values else None
+
+
+def get_token(scope):
+    return query_param(scope, 'token')
+
+
+def validate_token(token):
+    """Return the user id of a valid access token, or None."""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    try:
+        access_token = AccessToken(token)
+        user_id = access_token['user_id']
+    except (TokenError, KeyError):
+        return None
+    # Không giữ trong cache lâu hơn thời hạn của token
+    ttl = min(cache_ttl(), access_token['exp'] - time.time())
+    if ttl > 0:
+        token_cache.set(token, user_id, ttl)
+    return user_id
+
+
+@database_sync_to_async
+def _fetch_user(user_id):
+    return User.objects.filter(id=user_id, is_active=True).first()
+
+
+async def get_user(token):
+    if not token:
+        return AnonymousUser()
+    user_id = validate_token(token)
+    if user_id is None:
+        return AnonymousUser()
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await _fetch_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        user_cache.set(user_id, user, cache_ttl())
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=await get_user(get_token(scope)))
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,72 @@
+"""Structured, sampled logging for the websocket chat path.
+
+``log_event`` emits one record per event with its fields attached, skipping
+work entirely when the level is disabled and keeping only a fraction of
+high-volume events according to ``CHAT_LOG_SAMPLE_RATES``. Records are
+written by ``QueueStreamHandler``, which only enqueues on the event loop
+and leaves formatting and stream I/O to a listener thread.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+logger = logging.getLogger('api.chat')
+
+
+def sample_rate(event):
+    return getattr(settings, 'CHAT_LOG_SAMPLE_RATES', {}).get(event, 1.0)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    if not logger.isEnabledFor(level):
+        return
+    rate = sample_rate(event)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    if rate < 1.0:
+        fields['sample_rate'] = rate
+    logger.log(level, event, extra={'event': event, 'fields': fields})
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', record.getMessage()),
+        }
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class QueueStreamHandler(QueueHandler):
+    """Queue-backed handler writing to a stream from a background thread.
+
+    The formatter set on this handler (e.g. by ``LOGGING``) is installed on
+    the listener's stream handler, so records are formatted on the listener
+    thread rather than by ``QueueHandler.prepare`` on the caller's thread.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Chỉ sao chép record: msg/args/exc_info được giữ nguyên cho thread listener
+        return copy.copy(record)
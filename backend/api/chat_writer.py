@@ -0,0 +1,156 @@
+"""Buffered persistence for chat messages.
+
+``ChatConsumer`` hands unsaved ``Message`` objects to the writer of its
+event loop instead of inserting them one by one. The writer coalesces them
+into ``bulk_create`` batches, flushed when ``CHAT_WRITE_BATCH_SIZE``
+messages are pending or ``CHAT_WRITE_FLUSH_INTERVAL`` seconds after the
+first pending message, whichever comes first. Flushes are serialized so
+rows are inserted in arrival order; consumers flush on disconnect so
+nothing buffered is lost when a client leaves. A batch that fails with a
+database error is put back in front of the queue and retried, up to
+``CHAT_WRITE_MAX_ATTEMPTS`` attempts per message, before it is dropped.
+"""
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .models import Message
+from .conversations import record_messages
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
+# username -> (id, username) trong process hiện tại
+user_cache = LRUCache(getattr(settings, 'CHAT_USER_CACHE_SIZE', 10000))
+
+
+@database_sync_to_async
+def _fetch_user(username):
+    return User.objects.filter(username=username).values_list('id', 'username').first()
+
+
+async def lookup_user(username):
+    """Return ``(id, canonical username)`` for ``username`` or ``None``."""
+    user = user_cache.get(username)
+    if user is None:
+        user = await _fetch_user(username)
+        if user is not None:
+            user_cache.set(username, user)
+    return user
+
+
+class MessageWriter:
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_FLUSH_INTERVAL', 0.05)
+        self.max_attempts = getattr(settings, 'CHAT_WRITE_MAX_ATTEMPTS', 3)
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._tasks = set()
+
+    def add(self, message):
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Chat message flush failed', exc_info=task.exception())
+
+    async def flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, []
+            if batch:
+                try:
+                    await database_sync_to_async(self._write)(batch)
+                except DatabaseError:
+                    logger.exception('Writing %d chat messages failed', len(batch))
+                    self._requeue(batch)
+
+    def _requeue(self, batch):
+        retry = []
+        for message in batch:
+            message._write_attempts = getattr(message, '_write_attempts', 0) + 1
+            if message._write_attempts >= self.max_attempts:
+                logger.error('Dropping chat message from user %s to %s', message.sender_id, message.receiver_id)
+                continue
+            # bulk_create có thể đã gán pk trước khi transaction bị rollback
+            message.pk = None
+            retry.append(message)
+        if retry:
+            # Giữ thứ tự đến: lô lỗi đứng trước các tin mới được thêm trong lúc ghi
+            self._pending[:0] = retry
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    @staticmethod
+    def _write(batch):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                record_messages(batch)
+        except IntegrityError:
+            # Một người nhận có thể đã bị xóa: ghi từng dòng để không mất các tin khác
+            # (save() cập nhật ConversationSummary qua signal)
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        message.save(force_insert=True)
+                except IntegrityError:
+                    user_cache.clear()
+                    logger.exception('Dropping chat message from user %s to %s', message.sender_id, message.receiver_id)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_writer():
+    """Return the writer bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter()
+    return writer
@@ -1,71 +1,161 @@
-import json
+import asyncio
+import logging
+import time
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from rest_framework_simplejwt.tokens import AccessToken
-from django.contrib.auth.models import User
-from .models import Message
-from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Message, conversation_key
+from .chat_writer import get_writer, lookup_user
+from .conversations import mark_read
+from .channel_layers import group_send_many
+from .chat_logging import log_event
+from .presence import get_tracker
+from .chat_auth import query_param
+from .send_queue import SendQueue
+from .wire import negotiate, epoch_ms, from_epoch_ms
+
+# Mã đóng kết nối khi client đọc quá chậm (CHAT_SEND_OVERFLOW = 'disconnect')
+SLOW_CONSUMER_CLOSE_CODE = 4008
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        token = self.scope['query_string'].decode().split('token=')[1] if 'token=' in self.scope['query_string'].decode() else None
-        if not token:
-            print("No token provided, closing connection")
+        # User đã được JWTAuthMiddleware xác thực từ ?token=
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            log_event('chat.connect_rejected', logging.WARNING, reason='unauthenticated')
             await self.close()
             return
 
-        try:
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            self.user = await sync_to_async(User.objects.get)(id=user_id)
-            self.room_group_name = f'chat_{self.user.id}'
-            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-            await self.accept()
-            print(f"User {self.user.username} connected to WebSocket")
-        except Exception as e:
-            print(f"Authentication error: {e}")
-            await self.close()
+        self.user = user
+        # ?batch=1: nhiều frame đang chờ được gửi chung trong một mảng
+        self.batch_frames = query_param(self.scope, 'batch') in ('1', 'true')
+        # Định dạng frame: subprotocol chat.<format> hoặc ?format=, mặc định JSON
+        self.codec, subprotocol = negotiate(self.scope)
+        self.outbox = SendQueue(self.send_frames, on_overflow=self.on_overflow, log_fields={'user_id': user.id})
+        self.room_group_name = f'chat_{self.user.id}'
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept(subprotocol)
+        await get_tracker().join(self.channel_layer, self.user, self.channel_name)
+        log_event('chat.connect', user_id=self.user.id)
 
     async def disconnect(self, close_code):
+        # Ghi nốt các tin nhắn còn trong buffer trước khi đóng
+        await get_writer().flush()
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-            print(f"User {self.user.username} disconnected")
+            await get_tracker().leave(self.channel_layer, self.user, self.channel_name)
+            await self.outbox.close()
+            log_event('chat.disconnect', user_id=self.user.id, code=close_code)
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        print(f"Received data: {text_data_json}")
+    async def receive(self, text_data=None, bytes_data=None):
+        received_at = time.time()
+        text_data_json = self.codec.decode(text_data, bytes_data)
+        if text_data_json.get('type') == 'read':
+            await self.receive_read(text_data_json)
+            return
+        if text_data_json.get('type') == 'presence':
+            # Ai trong các cuộc trò chuyện gần đây đang online
+            online = await get_tracker().online_peers(self.user.id)
+            self.outbox.put(self.codec.presence_list(online))
+            return
         message = text_data_json['message']
         receiver_username = text_data_json['receiver']
-        try:
-            receiver = await sync_to_async(User.objects.get)(username=receiver_username)
-            msg = await sync_to_async(Message.objects.create)(
-                sender=self.user, receiver=receiver, content=message
-            )
-            data = {
-                'content': message,
-                'sender': self.user.username,
-                'timestamp': msg.timestamp.isoformat(),  # Dùng timestamp từ DB
-                'receiver': receiver.username  # Thêm receiver để frontend lọc
+        receiver = await lookup_user(receiver_username)
+        log_event('chat.message_received', logging.DEBUG, user_id=self.user.id, size=len(text_data or bytes_data))
+        if receiver is None:
+            log_event('chat.receiver_not_found', logging.WARNING, user_id=self.user.id, receiver=receiver_username)
+            self.outbox.put(self.codec.error('Receiver not found'))
+            return
+        receiver_id, receiver_username = receiver
+        # Tin nhắn được ghi theo lô (bulk_create), timestamp lấy ngay khi nhận
+        msg = Message(
+            sender_id=self.user.id, receiver_id=receiver_id, content=message, timestamp=timezone.now(),
+            conversation_id=conversation_key(self.user.id, receiver_id),
+        )
+        get_writer().add(msg)
+        data = {
+            'content': message,
+            'sender': self.user.username,
+            'timestamp': msg.timestamp.isoformat(),
+            'receiver': receiver_username,  # Thêm receiver để frontend lọc
+            # Cho các định dạng gọn (api.wire)
+            'sender_id': self.user.id,
+            'receiver_id': receiver_id,
+            'timestamp_ms': epoch_ms(msg.timestamp),
+        }
+        # Gửi một lần tới cả group của receiver và sender (tự nhắn cho mình thì chỉ một group)
+        await group_send_many(
+            self.channel_layer,
+            [f'chat_{receiver_id}', self.room_group_name],
+            {'type': 'chat_message', 'received_at': received_at, **data}
+        )
+
+    async def receive_read(self, data):
+        # {"type": "read", "peer": "<username>", "timestamp": "<timestamp của tin cuối đã xem>"}
+        # timestamp là chuỗi ISO hoặc epoch ms (định dạng gọn)
+        peer = await lookup_user(data.get('peer', ''))
+        if peer is None:
+            self.outbox.put(self.codec.error('Receiver not found'))
+            return
+        read_at = timezone.now()
+        timestamp = data.get('timestamp')
+        if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+            try:
+                read_at = from_epoch_ms(timestamp)
+            except (OverflowError, OSError, ValueError):
+                # Số quá lớn/âm ngoài phạm vi, NaN hoặc inf
+                self.outbox.put(self.codec.error('Invalid timestamp'))
+                return
+        elif timestamp:
+            try:
+                read_at = parse_datetime(timestamp)
+            except (TypeError, ValueError):
+                read_at = None
+            if read_at is None:
+                self.outbox.put(self.codec.error('Invalid timestamp'))
+                return
+            if timezone.is_naive(read_at):
+                read_at = timezone.make_aware(read_at)
+        peer_id, peer_username = peer
+        summary = await database_sync_to_async(mark_read)(self.user.id, peer_id, read_at)
+        if summary is None:
+            return
+        log_event('chat.read', logging.DEBUG, user_id=self.user.id, peer_id=peer_id, unread=summary.unread_count)
+        # Các tab khác của user nhận số chưa đọc mới, người kia nhận read receipt
+        await group_send_many(
+            self.channel_layer,
+            [self.room_group_name, f'chat_{peer_id}'],
+            {
+                'type': 'chat_read',
+                'reader': self.user.username,
+                'reader_id': self.user.id,
+                'peer': peer_username,
+                'peer_id': peer_id,
+                'read_at': summary.last_read_at.isoformat(),
+                'read_at_ms': epoch_ms(summary.last_read_at),
+                'unread_count': summary.unread_count,
             }
-            # Gửi đến group của receiver
-            await self.channel_layer.group_send(
-                f'chat_{receiver.id}',
-                {'type': 'chat_message', **data}
-            )
-            # Gửi đến group của sender
-            await self.channel_layer.group_send(
-                f'chat_{self.user.id}',
-                {'type': 'chat_message', **data}
-            )
-            print(f"Sent to groups: chat_{self.user.id} and chat_{receiver.id}")
-        except User.DoesNotExist:
-            print(f"Receiver {receiver_username} not found")
-            await self.send(json.dumps({'error': 'Receiver not found'}))
+        )
+
+    async def send_frames(self, frames):
+        if self.batch_frames and len(frames) > 1:
+            await self.send(**self.codec.encode(frames))
+        else:
+            for frame in frames:
+                await self.send(**self.codec.encode(frame))
+
+    def on_overflow(self):
+        log_event('chat.slow_consumer', logging.WARNING, user_id=self.user.id, queued=len(self.outbox))
+        asyncio.ensure_future(self.close(code=SLOW_CONSUMER_CLOSE_CODE))
+
+    # Các handler của channel layer chỉ đưa frame vào hàng đợi gửi
+    async def chat_read(self, event):
+        frame = self.codec.read(event, own=event['reader_id'] == self.user.id)
+        self.outbox.put(frame, key=('read', event['reader'], event['peer']))
+
+    async def chat_presence(self, event):
+        self.outbox.put(self.codec.presence(event), key=('presence', event['user']))
 
     async def chat_message(self, event):
-        print(f"Broadcasting message: {event}")
-        await self.send(text_data=json.dumps({
-            'content': event['content'],
-            'sender': event['sender'],
-            'timestamp': event['timestamp'],
-            'receiver': event['receiver']
-        }))
\ No newline at end of file
+        self.outbox.put(self.codec.message(event), received_at=event.get('received_at'))
@@ -0,0 +1,96 @@
+"""Incremental maintenance of ``ConversationSummary`` rows.
+
+Every persisted message updates two summaries: the sender's (new last
+message) and the receiver's (new last message and one more unread). The
+chat writer calls ``record_messages`` once per ``bulk_create`` batch, so a
+burst costs one statement per conversation side rather than per message.
+
+Read state is a watermark per summary (``last_read_at``) rather than a flag
+per message: ``mark_read`` moves it forward and recomputes ``unread_count``,
+so reading the count is always a single-row lookup.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import ConversationSummary, Message
+
+PREVIEW_LENGTH = 200
+
+
+def _unread_increment(timestamps):
+    # Tin ghi trễ có thể đã được đọc qua websocket: chỉ đếm tin mới hơn watermark
+    timestamps = sorted(timestamps)
+    whens = [
+        When(last_read_at__gte=timestamp, then=Value(len(timestamps) - 1 - i))
+        for i, timestamp in enumerate(timestamps)
+    ]
+    return Case(*reversed(whens), default=Value(len(timestamps)), output_field=IntegerField())
+
+
+def _upsert(user_id, peer_id, last, unread):
+    values = {
+        'conversation_id': last.conversation_id,
+        'last_message': last.content[:PREVIEW_LENGTH],
+        'last_sender_id': last.sender_id,
+        'last_message_at': last.timestamp,
+    }
+    unread_count = F('unread_count') + _unread_increment(unread) if unread else F('unread_count')
+    rows = ConversationSummary.objects.filter(user_id=user_id, peer_id=peer_id, last_message_at__lte=last.timestamp)
+    if rows.update(unread_count=unread_count, **values):
+        return
+    # Hàng đã mới hơn (ghi lệch thứ tự) hoặc chưa tồn tại
+    existing = ConversationSummary.objects.filter(user_id=user_id, peer_id=peer_id)
+    if existing.update(unread_count=unread_count):
+        return
+    try:
+        with transaction.atomic():
+            ConversationSummary.objects.create(user_id=user_id, peer_id=peer_id, unread_count=len(unread), **values)
+    except IntegrityError:
+        # Process khác vừa tạo hàng này
+        _upsert(user_id, peer_id, last, unread)
+
+
+def record_messages(messages):
+    """Fold newly persisted messages into both participants' summaries."""
+    sides = {}
+    for message in messages:
+        pairs = [(message.sender_id, message.receiver_id, False)]
+        if message.receiver_id != message.sender_id:
+            pairs.append((message.receiver_id, message.sender_id, True))
+        for user_id, peer_id, is_unread in pairs:
+            last, unread = sides.get((user_id, peer_id), (None, []))
+            if last is None or (message.timestamp, message.pk or 0) >= (last.timestamp, last.pk or 0):
+                last = message
+            if is_unread:
+                unread.append(message.timestamp)
+            sides[user_id, peer_id] = (last, unread)
+    with transaction.atomic():
+        for (user_id, peer_id), (last, unread) in sides.items():
+            _upsert(user_id, peer_id, last, unread)
+
+
+def mark_read(user_id, peer_id, read_at):
+    """Move ``user_id``'s read watermark in the conversation with ``peer_id``.
+
+    The watermark only moves forward and never past the current time.
+    Returns the updated summary, or ``None`` if the two users have not
+    exchanged any message yet.
+    """
+    read_at = min(read_at, timezone.now())
+    with transaction.atomic():
+        summary = ConversationSummary.objects.select_for_update().filter(user_id=user_id, peer_id=peer_id).first()
+        if summary is None:
+            return None
+        if summary.last_read_at is not None and read_at <= summary.last_read_at:
+            return summary
+        summary.last_read_at = read_at
+        if user_id == peer_id or read_at >= summary.last_message_at:
+            summary.unread_count = 0
+        else:
+            # Chỉ quét phần sau watermark trên index (conversation_id, timestamp, id)
+            summary.unread_count = Message.objects.filter(
+                conversation_id=summary.conversation_id, sender_id=peer_id, timestamp__gt=read_at,
+            ).count()
+        summary.save(update_fields=['last_read_at', 'unread_count'])
+    return summary
@@ -0,0 +1,196 @@
+"""HLS packaging of uploaded songs.
+
+When a song's ``audio_file`` changes, ``schedule_ingest`` segments it into
+fixed-duration chunks plus an ``.m3u8`` manifest under
+``MEDIA_ROOT/hls/<song id>/<source key>/`` and records the manifest path on
+``Song.hls_manifest``. The segmenting step is pluggable via the
+``HLS_SEGMENTER`` setting:
+
+* ``FFmpegSegmenter`` transcodes one AAC rendition per ``HLS_BITRATES``
+  entry and writes a master playlist for adaptive bitrate playback.
+* ``ByteSplitSegmenter`` needs no external tools: it cuts the MP3 stream
+  into byte ranges proportional to the track duration. It is meant for
+  development and tests.
+"""
+import hashlib
+import logging
+import math
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Song
+from . import playlists, response_cache
+
+logger = logging.getLogger(__name__)
+
+HLS_DIR = 'hls'
+MANIFEST_NAME = 'index.m3u8'
+
+
+class SegmenterError(Exception):
+    pass
+
+
+class ByteSplitSegmenter:
+    def __init__(self, segment_seconds):
+        self.segment_seconds = segment_seconds
+
+    def segment(self, source_path, output_dir, duration_seconds):
+        total = duration_seconds or self.segment_seconds
+        count = max(math.ceil(total / self.segment_seconds), 1)
+        durations = [self.segment_seconds] * (count - 1) + [total - self.segment_seconds * (count - 1)]
+        bytes_per_segment = math.ceil(os.path.getsize(source_path) / count)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(max(durations))}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        with open(source_path, 'rb') as source:
+            for i, seconds in enumerate(durations):
+                name = f'seg_{i:05d}.mp3'
+                with open(os.path.join(output_dir, name), 'wb') as out:
+                    out.write(source.read(bytes_per_segment))
+                lines += [f'#EXTINF:{seconds:.3f},', name]
+        lines.append('#EXT-X-ENDLIST')
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as manifest:
+            manifest.write('\n'.join(lines) + '\n')
+        return MANIFEST_NAME
+
+
+class FFmpegSegmenter:
+    def __init__(self, segment_seconds, bitrates=None, binary='ffmpeg'):
+        self.segment_seconds = segment_seconds
+        self.bitrates = bitrates or ['128k']
+        self.binary = binary
+
+    def segment(self, source_path, output_dir, duration_seconds):
+        variants = []
+        for bitrate in self.bitrates:
+            variant_dir = os.path.join(output_dir, bitrate)
+            os.makedirs(variant_dir, exist_ok=True)
+            command = [
+                self.binary, '-nostdin', '-loglevel', 'error', '-y',
+                '-i', source_path, '-vn', '-c:a', 'aac', '-b:a', bitrate,
+                '-f', 'hls', '-hls_time', str(self.segment_seconds),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(variant_dir, 'seg_%05d.ts'),
+                os.path.join(variant_dir, MANIFEST_NAME),
+            ]
+            try:
+                subprocess.run(command, check=True, capture_output=True)
+            except (OSError, subprocess.CalledProcessError) as e:
+                raise SegmenterError(f'ffmpeg failed for {source_path}: {e}') from e
+            variants.append(bitrate)
+
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for bitrate in variants:
+            bandwidth = int(bitrate.rstrip('k')) * 1000
+            lines += [f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="mp4a.40.2"', f'{bitrate}/{MANIFEST_NAME}']
+        with open(os.path.join(output_dir, 'master.m3u8'), 'w') as master:
+            master.write('\n'.join(lines) + '\n')
+        return 'master.m3u8'
+
+
+def get_segmenter():
+    segmenter_class = import_string(getattr(settings, 'HLS_SEGMENTER', 'api.hls.FFmpegSegmenter'))
+    options = {'segment_seconds': getattr(settings, 'HLS_SEGMENT_SECONDS', 6)}
+    if segmenter_class is FFmpegSegmenter:
+        options['bitrates'] = getattr(settings, 'HLS_BITRATES', None)
+    return segmenter_class(**options)
+
+
+def source_key(song):
+    return hashlib.sha1(song.audio_file.name.encode()).hexdigest()[:12]
+
+
+def song_dir(song_id):
+    # Đường dẫn tương đối trong storage, luôn dùng '/'
+    return f'{HLS_DIR}/{song_id}'
+
+
+def song_root(song_id):
+    return os.path.join(settings.MEDIA_ROOT, HLS_DIR, str(song_id))
+
+
+def needs_ingest(song):
+    if not song.audio_file:
+        return bool(song.hls_manifest)
+    return not song.hls_manifest.startswith(f'{song_dir(song.id)}/{source_key(song)}/')
+
+
+def ingest(song_id):
+    """Segment the current audio file of a song and record its manifest."""
+    try:
+        song = Song.objects.get(pk=song_id)
+    except Song.DoesNotExist:
+        return
+    root = song_root(song.id)
+    if not song.audio_file:
+        shutil.rmtree(root, ignore_errors=True)
+        Song.objects.filter(pk=song.id).update(hls_manifest='')
+        playlists.touch_songs([song.id])
+        response_cache.invalidate('song')
+        return
+
+    key = source_key(song)
+    output_dir = os.path.join(root, key)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    duration = song.duration.total_seconds() if song.duration else None
+    try:
+        manifest = get_segmenter().segment(song.audio_file.path, output_dir, duration)
+    except SegmenterError:
+        logger.exception('HLS segmenting failed for song %s', song.id)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return
+
+    manifest_path = f'{song_dir(song.id)}/{key}/{manifest}'
+    updated = Song.objects.filter(pk=song.id, audio_file=song.audio_file.name).update(hls_manifest=manifest_path)
+    if not updated:
+        # File audio đã bị thay đổi trong lúc xử lý; lần ingest sau sẽ tạo lại
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return
+    # .update() bỏ qua signal: hls_url trong chi tiết playlist đã đổi
+    playlists.touch_songs([song.id])
+    response_cache.invalidate('song')
+    for entry in os.listdir(root):
+        if entry != key:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hls-ingest')
+
+
+def _ingest_in_background(song_id):
+    try:
+        ingest(song_id)
+    except Exception:
+        logger.exception('HLS ingest failed for song %s', song_id)
+    finally:
+        connection.close()
+
+
+def remove_files(song_id):
+    shutil.rmtree(song_root(song_id), ignore_errors=True)
+
+
+def schedule_ingest(song):
+    """Run ``ingest`` after the current transaction commits.
+
+    With ``HLS_INGEST_ASYNC`` the work runs on a background thread so
+    uploads are not held up by transcoding.
+    """
+    if not needs_ingest(song):
+        return
+    if getattr(settings, 'HLS_INGEST_ASYNC', True):
+        transaction.on_commit(lambda: _executor.submit(_ingest_in_background, song.id))
+    else:
+        transaction.on_commit(lambda: ingest(song.id))
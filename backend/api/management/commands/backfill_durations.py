@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api import playlists
+from api.audio_probe import probe_duration
+from api.models import PlaylistEntry, Song
+from api.response_cache import invalidate
+
+
+class Command(BaseCommand):
+    help = 'Fill Song.duration from the audio file header for songs without a duration'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every song, not only missing durations')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        songs = Song.objects.exclude(audio_file='').only('id', 'audio_file', 'duration').order_by('id')
+        if not options['all']:
+            songs = songs.filter(duration=timedelta(0))
+
+        batch, updated, failed = [], 0, 0
+        for song in songs.iterator(chunk_size=options['batch_size']):
+            try:
+                with song.audio_file.open('rb') as f:
+                    duration = probe_duration(f)
+            except OSError:
+                duration = None
+            if duration is None:
+                failed += 1
+                self.stderr.write(f'Could not read duration of song {song.id} ({song.audio_file.name})')
+                continue
+            if duration != song.duration:
+                song.duration = duration
+                batch.append(song)
+            if len(batch) >= options['batch_size']:
+                updated += self.save(batch)
+                batch = []
+        if batch:
+            updated += self.save(batch)
+        if updated:
+            invalidate('song')
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} songs, {failed} could not be read'))
+
+    def save(self, songs):
+        updated = Song.objects.bulk_update(songs, ['duration'])
+        # bulk_update bỏ qua signal: tính lại tổng thời lượng và version của playlist
+        playlists.touch(
+            PlaylistEntry.objects.filter(song_id__in=[song.id for song in songs]).order_by().values_list('playlist_id', flat=True)
+        )
+        return updated
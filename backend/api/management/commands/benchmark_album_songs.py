@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from api.models import Album, Artist, Song
+from api.views import AddSongToAlbumView
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark AddSongToAlbumView on a large album; all data is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['songs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, count):
+        artist = Artist.objects.create(name='benchmark-album-songs')
+        album = Album.objects.create(title='Benchmark', artist=artist)
+        other = Album.objects.create(title='Benchmark (other)', artist=artist)
+        # Gấp rưỡi số bài để có bài chưa thuộc album nào khi hoán đổi một nửa
+        Song.objects.bulk_create(
+            [Song(title=f'Benchmark {i}', duration=timedelta(minutes=3)) for i in range(count + count // 2 + 1)],
+            batch_size=1000,
+        )
+        ids = list(Song.objects.filter(title__startswith='Benchmark ').order_by('id').values_list('id', flat=True))
+        first, swapped = ids[:count], ids[count // 2:]
+        Song.objects.filter(pk=ids[-1]).update(album=other)
+        self.stdout.write(f'album with {count} songs:')
+        self.bench(album, f'assign {count} songs to an empty album', first)
+        self.bench(album, 'same song list again', first)
+        self.bench(album, f'swap {count // 2} songs out and {count // 2} in', swapped[:count])
+        self.bench(album, 'rejected (one song belongs to another album)', first[:-1] + [ids[-1]])
+
+    def bench(self, album, label, song_ids):
+        request = APIRequestFactory().put(f'/api/albums/{album.pk}/add_songs/', {'song_ids': song_ids}, format='json')
+        view = AddSongToAlbumView.as_view()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = view(request, album_id=album.pk)
+            seconds = time.perf_counter() - started
+        self.stdout.write(f'  {label}: {seconds * 1000:.0f} ms, {len(queries)} queries, HTTP {response.status_code}')
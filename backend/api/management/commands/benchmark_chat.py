@@ -0,0 +1,109 @@
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import chat_auth
+from api.chat_auth import JWTAuthMiddleware
+from api.channel_layers import MultiGroupInMemoryChannelLayer, group_send_many
+from api.consumers import ChatConsumer
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'api.channel_layers.MultiGroupInMemoryChannelLayer'}}
+
+
+class CountingLayer(MultiGroupInMemoryChannelLayer):
+    """In-memory layer that counts layer calls and per-channel deliveries."""
+
+    def __init__(self, **kwargs):
+        super().__init__(capacity=1_000_000, **kwargs)
+        self.calls = 0
+        self.deliveries = 0
+
+    async def send(self, channel, message):
+        self.deliveries += 1
+        await super().send(channel, message)
+
+    async def group_send(self, group, message):
+        self.calls += 1
+        await super().group_send(group, message)
+
+    async def group_send_many(self, groups, message):
+        self.calls += 1
+        await super().group_send_many(groups, message)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the chat websocket path against an in-memory channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to connect as (defaults to the first user)')
+        parser.add_argument('--connects', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=20000)
+
+    def get_user(self, username):
+        users = User.objects.order_by('id')
+        user = users.filter(username=username).first() if username else users.first()
+        if user is None:
+            raise CommandError('No user to benchmark with')
+        return user
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        # Không để log connect/disconnect làm nhiễu kết quả
+        logging.getLogger('api.chat').setLevel(logging.WARNING)
+        token = str(AccessToken.for_user(user))
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+            self.report('connect (cold cache)', options['connects'], async_to_sync(self.bench_connects)(token, options['connects'], cold=True))
+            self.report('connect (warm cache)', options['connects'], async_to_sync(self.bench_connects)(token, options['connects'], cold=False))
+        for name, self_chat in [('fan-out', False), ('fan-out to self', True)]:
+            for multi in (False, True):
+                label = f"{name} ({'group_send_many' if multi else 'group_send per group'})"
+                seconds, layer = async_to_sync(self.bench_fanout)(options['messages'], multi, self_chat)
+                self.report(label, options['messages'], seconds)
+                self.stdout.write(
+                    f'  layer calls/message: {layer.calls / options["messages"]:.1f}, '
+                    f'deliveries/message: {layer.deliveries / options["messages"]:.1f}'
+                )
+
+    def report(self, name, count, seconds):
+        self.stdout.write(f'{name}: {count} in {seconds:.3f}s, {count / seconds:.0f}/s')
+
+    async def bench_connects(self, token, count, cold):
+        application = JWTAuthMiddleware(ChatConsumer.as_asgi())
+        started = time.perf_counter()
+        for _ in range(count):
+            if cold:
+                chat_auth.token_cache.clear()
+                chat_auth.user_cache.clear()
+            communicator = WebsocketCommunicator(application, f'/ws/chat/?token={token}')
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError('Connection was rejected')
+            await communicator.disconnect()
+        return time.perf_counter() - started
+
+    async def bench_fanout(self, count, multi, self_chat):
+        # Mô phỏng receive(): gửi tới group của receiver và của sender
+        layer = CountingLayer()
+        sender = await layer.new_channel()
+        receiver = sender if self_chat else await layer.new_channel()
+        await layer.group_add('chat_1', sender)
+        await layer.group_add('chat_2' if not self_chat else 'chat_1', receiver)
+        groups = ['chat_1', 'chat_1' if self_chat else 'chat_2']
+        message = {'type': 'chat_message', 'content': 'hello', 'sender': 'a', 'receiver': 'b', 'timestamp': ''}
+        started = time.perf_counter()
+        for _ in range(count):
+            if multi:
+                await group_send_many(layer, groups, message)
+            else:
+                for group in groups:
+                    await layer.group_send(group, message)
+            for channel in {sender, receiver}:
+                while layer.channels.get(channel):
+                    await layer.receive(channel)
+        return time.perf_counter() - started, layer
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+from api.search import tokenize
+
+
+def build_search_documents(apps, schema_editor):
+    Song = apps.get_model('api', 'Song')
+    songs = Song.objects.select_related('album').prefetch_related('artists')
+    for song in songs.iterator(chunk_size=500):
+        texts = [song.title] + [artist.name for artist in song.artists.all()]
+        if song.album is not None:
+            texts.append(song.album.title)
+        song.search_document = ' '.join(token for text in texts for token in tokenize(text))
+        song.save(update_fields=['search_document'])
+
+
+def add_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX api_song_search_document_ft ON api_song (search_document)'
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX api_song_search_document_ft ON api_song')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_remove_song_video_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_song_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='hls_manifest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def fill_conversation_ids(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    pairs = Message.objects.values_list('sender_id', 'receiver_id').distinct()
+    for sender_id, receiver_id in pairs.iterator():
+        low, high = sorted((sender_id, receiver_id))
+        Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id).update(
+            conversation_id=f'{low}:{high}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation_id',
+            field=models.CharField(default='', editable=False, max_length=41),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_conversation_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation_id', 'timestamp', 'id'], name='message_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    ConversationSummary = apps.get_model('api', 'ConversationSummary')
+    conversation_ids = Message.objects.values_list('conversation_id', flat=True).distinct()
+    summaries = []
+    for conversation_id in conversation_ids.iterator():
+        last = Message.objects.filter(conversation_id=conversation_id).order_by('-timestamp', '-id').first()
+        sides = {(last.sender_id, last.receiver_id), (last.receiver_id, last.sender_id)}
+        for user_id, peer_id in sides:
+            summaries.append(ConversationSummary(
+                user_id=user_id, peer_id=peer_id, conversation_id=conversation_id,
+                last_message=last.content[:200], last_sender_id=last.sender_id,
+                last_message_at=last.timestamp,
+            ))
+    ConversationSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_message_conversation_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_id', models.CharField(max_length=41)),
+                ('last_message', models.TextField(blank=True, default='')),
+                ('last_message_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_sender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peer_summaries', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_message_at'], name='summary_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'peer'), name='unique_conversation_summary')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_backfilled_read(apps, schema_editor):
+    # Các hàng backfill từ 0019 không có số chưa đọc: coi như đã đọc tới tin cuối
+    ConversationSummary = apps.get_model('api', 'ConversationSummary')
+    ConversationSummary.objects.filter(unread_count=0).update(last_read_at=F('last_message_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_backfilled_read, migrations.RunPython.noop),
+    ]
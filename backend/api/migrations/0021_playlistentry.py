@@ -0,0 +1,52 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSITION_GAP = 1 << 16
+
+
+def copy_memberships(apps, schema_editor):
+    Playlist = apps.get_model('api', 'Playlist')
+    PlaylistEntry = apps.get_model('api', 'PlaylistEntry')
+    rows = Playlist.songs.through.objects.order_by('playlist_id', 'id').values_list('playlist_id', 'song_id')
+    entries, last_playlist, position = [], None, 0
+    for playlist_id, song_id in rows.iterator():
+        if playlist_id != last_playlist:
+            last_playlist, position = playlist_id, 0
+        position += POSITION_GAP
+        entries.append(PlaylistEntry(playlist_id=playlist_id, song_id=song_id, position=position))
+    PlaylistEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_conversationsummary_last_read_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField(null=True)),
+                ('added_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='api.playlist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.song')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+                'indexes': [models.Index(fields=['playlist', 'position'], name='playlist_entry_position_idx')],
+            },
+        ),
+        migrations.RunPython(copy_memberships, migrations.RunPython.noop),
+        # Không thể thêm through= vào M2M có sẵn: bỏ bảng tự sinh rồi khai báo lại
+        migrations.RemoveField(
+            model_name='playlist',
+            name='songs',
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='songs',
+            field=models.ManyToManyField(through='api.PlaylistEntry', to='api.song'),
+        ),
+    ]
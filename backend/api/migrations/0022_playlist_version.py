@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_playlistentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_aggregates(apps, schema_editor):
+    Playlist = apps.get_model('api', 'Playlist')
+    PlaylistEntry = apps.get_model('api', 'PlaylistEntry')
+    totals = {
+        row['playlist_id']: row
+        for row in PlaylistEntry.objects.values('playlist_id').annotate(count=Count('id'), duration=Sum('song__duration'))
+    }
+    playlists = list(Playlist.objects.only('id'))
+    for playlist in playlists:
+        row = totals.get(playlist.id, {})
+        playlist.song_count = row.get('count', 0)
+        playlist.total_duration = row.get('duration') or datetime.timedelta()
+        covers = []
+        rows = (
+            PlaylistEntry.objects.filter(playlist_id=playlist.id).order_by('position', 'id')
+            .values_list('song__album__image', 'song__image')[:64]
+        )
+        for album_image, song_image in rows:
+            cover = album_image or song_image
+            if cover and cover not in covers:
+                covers.append(cover)
+                if len(covers) == 4:
+                    break
+        playlist.covers = covers
+    Playlist.objects.bulk_update(playlists, ['song_count', 'total_duration', 'covers'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_playlist_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='covers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='total_duration',
+            field=models.DurationField(default=datetime.timedelta),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
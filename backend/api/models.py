@@ -1,5 +1,8 @@
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
     
 # Model Nghệ sĩ (Artist)
 class Artist(models.Model):
@@ -28,6 +31,10 @@ class Song(models.Model):
     duration = models.DurationField()
     audio_file = models.FileField(upload_to='album_covers/', default='')
     video_file = models.FileField(upload_to='song_videos/', blank=True, null=True)
+    # Tiêu đề, nghệ sĩ, album đã chuẩn hóa; được cập nhật bởi api.signals
+    search_document = models.TextField(blank=True, default='', editable=False)
+    # Đường dẫn (trong MEDIA_ROOT) tới manifest HLS, do api.hls tạo ra
+    hls_manifest = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     def __str__(self):
         return self.title
@@ -36,20 +43,86 @@ class Song(models.Model):
 class Playlist(models.Model):
     name = models.CharField(max_length=100)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    songs = models.ManyToManyField(Song)
+    songs = models.ManyToManyField(Song, through='PlaylistEntry')
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Tăng mỗi khi nội dung playlist thay đổi (api.playlists)
+    version = models.PositiveIntegerField(default=0)
+    # Tổng hợp để hiển thị danh sách playlist không cần đọc bài hát (api.playlists)
+    song_count = models.PositiveIntegerField(default=0)
+    total_duration = models.DurationField(default=timedelta)
+    covers = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return self.name
 
+    @property
+    def ordered_songs(self):
+        # Theo thứ tự trong playlist, có thể lặp bài (dùng với prefetch 'entries')
+        return [entry.song for entry in self.entries.all()]
+
+# Một dòng cho mỗi lần bài hát xuất hiện trong playlist (api.playlists)
+class PlaylistEntry(models.Model):
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='entries')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # Vị trí thưa, cách nhau POSITION_GAP: chèn/di chuyển chỉ ghi một dòng
+    position = models.BigIntegerField(null=True)
+    added_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['playlist', 'position'], name='playlist_entry_position_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.playlist} #{self.position}: {self.song}'
+
+def conversation_key(user_id, other_id):
+    # Khóa chung cho cuộc trò chuyện giữa hai user, không phụ thuộc ai gửi
+    low, high = sorted((int(user_id), int(other_id)))
+    return f'{low}:{high}'
+
 class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
+    conversation_id = models.CharField(max_length=41, editable=False)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Gán sẵn khi nhận qua websocket để tin nhắn ghi theo lô giữ đúng thời điểm gửi
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['conversation_id', 'timestamp', 'id'], name='message_conversation_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.conversation_id:
+            self.conversation_id = conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.sender} to {self.receiver}: {self.content}'
+
+# Tóm tắt cuộc trò chuyện theo từng user, cập nhật mỗi khi có tin nhắn mới (api.conversations)
+class ConversationSummary(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='peer_summaries')
+    conversation_id = models.CharField(max_length=41)
+    last_message = models.TextField(blank=True, default='')
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_message_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+    # Watermark đã đọc: mọi tin có timestamp <= last_read_at coi như đã đọc
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'peer'], name='unique_conversation_summary'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at'], name='summary_recent_idx'),
+        ]
 
     def __str__(self):
-        return f'{self.sender} to {self.receiver}: {self.content}'
\ No newline at end of file
+        return f'{self.user} - {self.peer}'
\ No newline at end of file
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """Keyset pagination, only applied when the client asks for it.
+
+    Requests without ``cursor`` or ``page_size`` keep receiving the full list
+    so existing clients continue to work.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class PlaylistEntryPagination(CursorPagination):
+    # Luôn phân trang: playlist có thể có hàng chục nghìn bài
+    ordering = ('position', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+MESSAGE_WINDOW_DEFAULT = 50
+MESSAGE_WINDOW_MAX = 200
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_message_cursor(message):
+    micros = (message.timestamp - _EPOCH) // timedelta(microseconds=1)
+    return f'{micros}_{message.id}'
+
+
+def decode_message_cursor(value):
+    try:
+        micros, message_id = value.split('_')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(message_id)
+    except (ValueError, OverflowError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def message_window(queryset, params, serializer_class, oldest_first=False):
+    """Return up to ``limit`` messages around a ``before``/``after`` cursor.
+
+    Without a cursor the most recent messages are returned, or the oldest
+    ones with ``oldest_first`` (e.g. unread messages after a watermark).
+    Results are always oldest first; ``before_cursor``/``after_cursor``
+    point at the first and last message so clients can keep scrolling in
+    either direction, and ``has_more`` tells whether the requested direction
+    has further messages.
+    """
+    try:
+        limit = min(max(int(params.get('limit', MESSAGE_WINDOW_DEFAULT)), 1), MESSAGE_WINDOW_MAX)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer'})
+
+    if params.get('after') or (oldest_first and not params.get('before')):
+        if params.get('after'):
+            timestamp, message_id = decode_message_cursor(params['after'])
+            queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+        queryset = queryset.order_by('timestamp', 'id')
+        messages = list(queryset[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if params.get('before'):
+            timestamp, message_id = decode_message_cursor(params['before'])
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+            )
+        messages = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+    return {
+        'results': serializer_class(messages, many=True).data,
+        'before_cursor': encode_message_cursor(messages[0]) if messages else None,
+        'after_cursor': encode_message_cursor(messages[-1]) if messages else None,
+        'has_more': has_more,
+    }
@@ -0,0 +1,375 @@
+"""Ordered playlist storage.
+
+Each occurrence of a song in a playlist is a ``PlaylistEntry`` row with a
+sparse ``position``: appended entries are ``POSITION_GAP`` apart, and an
+insert or move takes the midpoint of its neighbours, so it writes exactly
+one row. Only when two neighbours have run out of room is the playlist
+renumbered (``rebalance``), which is rare. Every write starts by bumping
+``Playlist.version``; the UPDATE locks the playlist row until commit, so
+concurrent edits of the same playlist are serialized.
+
+Each playlist also stores its aggregates for list views: ``song_count``,
+``total_duration`` and ``covers`` (the first ``COVER_COUNT`` distinct album
+covers, in playlist order). Writes here adjust count and duration by the
+songs they add or remove and recompute the covers from the head of the
+playlist. Song edits go through ``song_changed`` (a duration delta, covers
+only if the cover changed); other changes made elsewhere go through
+``touch``, which recounts, or ``touch_songs`` when only the way songs are
+displayed changed (artists, HLS manifest).
+
+``Playlist.songs`` stays a many-to-many through ``PlaylistEntry``:
+``songs.add()`` still works, and the ``m2m_changed`` receiver calls
+``fill_positions`` to append the new rows in insertion order.
+"""
+from datetime import timedelta
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+
+from .models import Playlist, PlaylistEntry, Song
+
+POSITION_GAP = 1 << 16
+COVER_COUNT = 4
+# Số entry đầu playlist được xét khi tìm ảnh bìa
+COVER_SCAN = 64
+
+
+def _lock(playlist_id):
+    Playlist.objects.filter(pk=playlist_id).update(version=F('version') + 1)
+
+
+def touch(playlist_ids):
+    """Bump the version of playlists whose content changed outside this module
+    and recompute their aggregates."""
+    playlist_ids = set(playlist_ids)
+    if not playlist_ids:
+        return
+    with transaction.atomic():
+        Playlist.objects.filter(pk__in=playlist_ids).update(version=F('version') + 1)
+        totals = {
+            row['playlist_id']: row
+            for row in PlaylistEntry.objects.filter(playlist_id__in=playlist_ids).values('playlist_id')
+            .annotate(count=Count('id'), duration=Sum('song__duration'))
+        }
+        summaries = []
+        for playlist_id in playlist_ids:
+            row = totals.get(playlist_id, {})
+            summaries.append(Playlist(
+                pk=playlist_id,
+                song_count=row.get('count', 0),
+                total_duration=row.get('duration') or timedelta(),
+                covers=_covers(playlist_id),
+            ))
+        Playlist.objects.bulk_update(summaries, ['song_count', 'total_duration', 'covers'], batch_size=1000)
+
+
+def song_playlists(song_id):
+    return set(PlaylistEntry.objects.filter(song_id=song_id).values_list('playlist_id', flat=True))
+
+
+def touch_songs(song_ids):
+    """Bump the version of playlists containing ``song_ids``; aggregates are
+    left as they are (the songs' artists or stream changed)."""
+    song_ids = set(song_ids)
+    if song_ids:
+        Playlist.objects.filter(
+            pk__in=PlaylistEntry.objects.filter(song_id__in=song_ids).values('playlist_id')
+        ).update(version=F('version') + 1)
+
+
+def touch_covers(playlist_ids):
+    """Bump the version of playlists and recompute only their covers
+    (a song's album or image changed; count and duration did not)."""
+    playlist_ids = set(playlist_ids)
+    if not playlist_ids:
+        return
+    with transaction.atomic():
+        Playlist.objects.filter(pk__in=playlist_ids).update(version=F('version') + 1)
+        Playlist.objects.bulk_update(
+            [Playlist(pk=playlist_id, covers=_covers(playlist_id)) for playlist_id in playlist_ids],
+            ['covers'], batch_size=1000,
+        )
+
+
+def song_changed(song_id, duration_delta=None, cover_changed=False):
+    """Apply an edit of ``song_id`` to the playlists containing it.
+
+    Their version is bumped; ``total_duration`` moves by ``duration_delta``
+    per occurrence of the song, and covers are recomputed only if the
+    song's cover (album or image) changed.
+    """
+    occurrences = dict(
+        PlaylistEntry.objects.filter(song_id=song_id).order_by().values('playlist_id')
+        .annotate(count=Count('id')).values_list('playlist_id', 'count')
+    )
+    if not occurrences:
+        return
+    with transaction.atomic():
+        if duration_delta:
+            by_count = {}
+            for playlist_id, count in occurrences.items():
+                by_count.setdefault(count, []).append(playlist_id)
+            # Thường mỗi bài xuất hiện một lần: một UPDATE cho mọi playlist
+            for count, playlist_ids in by_count.items():
+                Playlist.objects.filter(pk__in=playlist_ids).update(
+                    version=F('version') + 1,
+                    total_duration=F('total_duration') + duration_delta * count,
+                )
+        else:
+            Playlist.objects.filter(pk__in=occurrences).update(version=F('version') + 1)
+        if cover_changed:
+            Playlist.objects.bulk_update(
+                [Playlist(pk=playlist_id, covers=_covers(playlist_id)) for playlist_id in occurrences],
+                ['covers'], batch_size=1000,
+            )
+
+
+def _covers(playlist_id):
+    covers = []
+    rows = (
+        PlaylistEntry.objects.filter(playlist_id=playlist_id).order_by('position', 'id')
+        .values_list('song__album__image', 'song__image')[:COVER_SCAN]
+    )
+    for album_image, song_image in rows:
+        # Bài không thuộc album nào thì dùng ảnh của bài
+        cover = album_image or song_image
+        if cover and cover not in covers:
+            covers.append(cover)
+            if len(covers) == COVER_COUNT:
+                break
+    return covers
+
+
+def _adjust(playlist_id, added=(), removed=()):
+    """Apply the songs added and removed (lists of song ids, repeats counted)
+    to the playlist's count and duration, and recompute its covers."""
+    values = {'covers': _covers(playlist_id)}
+    if added or removed:
+        durations = dict(Song.objects.filter(pk__in=set(added) | set(removed)).values_list('pk', 'duration'))
+        delta = sum((durations.get(song_id, timedelta()) for song_id in added), timedelta())
+        delta -= sum((durations.get(song_id, timedelta()) for song_id in removed), timedelta())
+        values['song_count'] = F('song_count') + len(added) - len(removed)
+        values['total_duration'] = F('total_duration') + delta
+    Playlist.objects.filter(pk=playlist_id).update(**values)
+
+
+def _last_position(playlist_id):
+    return PlaylistEntry.objects.filter(playlist_id=playlist_id).aggregate(last=Max('position'))['last'] or 0
+
+
+def _neighbours(playlist_id, after_id):
+    """Return the positions just before and after the insertion point."""
+    entries = PlaylistEntry.objects.filter(playlist_id=playlist_id)
+    if after_id is None:
+        low = None
+        following = entries
+    else:
+        low = entries.values_list('position', flat=True).get(pk=after_id)
+        following = entries.filter(position__gt=low)
+    high = following.order_by('position').values_list('position', flat=True).first()
+    return low, high
+
+
+def _position_between(low, high):
+    if low is None and high is None:
+        return POSITION_GAP
+    if high is None:
+        return low + POSITION_GAP
+    if low is None:
+        return high - POSITION_GAP
+    if high - low < 2:
+        return None
+    return (low + high) // 2
+
+
+def _free_position(playlist_id, after_id):
+    position = _position_between(*_neighbours(playlist_id, after_id))
+    if position is None:
+        rebalance(playlist_id)
+        position = _position_between(*_neighbours(playlist_id, after_id))
+    return position
+
+
+def rebalance(playlist_id):
+    """Renumber a playlist's entries ``POSITION_GAP`` apart, keeping their order."""
+    entries = list(PlaylistEntry.objects.filter(playlist_id=playlist_id).order_by('position', 'id').only('id', 'position'))
+    for index, entry in enumerate(entries, 1):
+        entry.position = index * POSITION_GAP
+    PlaylistEntry.objects.bulk_update(entries, ['position'], batch_size=1000)
+
+
+def _append(playlist_id, song_ids):
+    last = _last_position(playlist_id)
+    entries = PlaylistEntry.objects.bulk_create([
+        PlaylistEntry(playlist_id=playlist_id, song_id=song_id, position=last + index * POSITION_GAP)
+        for index, song_id in enumerate(song_ids, 1)
+    ])
+    if entries and entries[0].pk is None:
+        # MySQL không trả id sau bulk_create: các vị trí mới đều lớn hơn `last`
+        entries = list(PlaylistEntry.objects.filter(playlist_id=playlist_id, position__gt=last).order_by('position'))
+    return entries
+
+
+def append(playlist_id, song_ids):
+    """Append songs (duplicates allowed) and return the new entries."""
+    with transaction.atomic():
+        _lock(playlist_id)
+        entries = _append(playlist_id, song_ids)
+        _adjust(playlist_id, added=song_ids)
+        return entries
+
+
+def insert(playlist_id, song_id, after_id=None):
+    """Insert a song after the entry ``after_id`` (``None``: at the start)."""
+    with transaction.atomic():
+        _lock(playlist_id)
+        position = _free_position(playlist_id, after_id)
+        entry = PlaylistEntry.objects.create(playlist_id=playlist_id, song_id=song_id, position=position)
+        _adjust(playlist_id, added=[song_id])
+        return entry
+
+
+def move(entry, after_id=None):
+    """Move ``entry`` after the entry ``after_id`` (``None``: to the start)."""
+    with transaction.atomic():
+        _lock(entry.playlist_id)
+        if after_id == entry.pk:
+            return entry
+        entry.position = _free_position(entry.playlist_id, after_id)
+        PlaylistEntry.objects.filter(pk=entry.pk).update(position=entry.position)
+        _adjust(entry.playlist_id)
+        return entry
+
+
+def remove(playlist_id, entry_ids):
+    """Delete entries; return how many were removed."""
+    with transaction.atomic():
+        _lock(playlist_id)
+        entries = PlaylistEntry.objects.filter(playlist_id=playlist_id, pk__in=entry_ids)
+        song_ids = list(entries.values_list('song_id', flat=True))
+        deleted, _ = entries.delete()
+        if deleted:
+            _adjust(playlist_id, removed=song_ids)
+        return deleted
+
+
+def apply_changes(playlist_id, add=(), remove=()):
+    """Remove every entry of the songs in ``remove``, then append ``add``.
+
+    Returns a compact delta: the new entries, the ids of the removed
+    ones, the resulting entry count and the new playlist version.
+    """
+    with transaction.atomic():
+        _lock(playlist_id)
+        removed = []
+        if remove:
+            entries = PlaylistEntry.objects.filter(playlist_id=playlist_id, song_id__in=set(remove))
+            removed = list(entries.values_list('pk', 'song_id'))
+            PlaylistEntry.objects.filter(pk__in=[entry_id for entry_id, _ in removed]).delete()
+        added = _append(playlist_id, add) if add else []
+        _adjust(playlist_id, added=add, removed=[song_id for _, song_id in removed])
+        playlist = Playlist.objects.values('version', 'song_count').get(pk=playlist_id)
+        return {
+            'added': [{'id': e.pk, 'song': e.song_id, 'position': e.position} for e in added],
+            'removed': [entry_id for entry_id, _ in removed],
+            'count': playlist['song_count'],
+            'version': playlist['version'],
+        }
+
+
+def fill_positions(playlist_ids):
+    """Give entries created through ``Playlist.songs.add()`` a position at the end."""
+    for playlist_id in playlist_ids:
+        with transaction.atomic():
+            _lock(playlist_id)
+            new = list(PlaylistEntry.objects.filter(playlist_id=playlist_id, position__isnull=True).order_by('id').only('id', 'song_id'))
+            if not new:
+                continue
+            last = _last_position(playlist_id)
+            for index, entry in enumerate(new, 1):
+                entry.position = last + index * POSITION_GAP
+            PlaylistEntry.objects.bulk_update(new, ['position'])
+            _adjust(playlist_id, added=[entry.song_id for entry in new])
+
+
+def replace(playlist_id, song_ids):
+    """Make the playlist contain exactly ``song_ids``, in that order.
+
+    Entries that keep their relative order are left untouched; only the
+    removed ones are deleted and the new ones inserted into the gaps
+    around them. Returns ``(added, removed)`` counts.
+    """
+    song_ids = list(song_ids)
+    with transaction.atomic():
+        _lock(playlist_id)
+        entries = list(
+            PlaylistEntry.objects.filter(playlist_id=playlist_id).order_by('position', 'id')
+            .values_list('id', 'song_id', 'position')
+        )
+        matcher = SequenceMatcher(None, [song_id for _, song_id, _ in entries], song_ids, autojunk=False)
+        removed, removed_songs, final = [], [], []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                final.extend(entries[i1:i2])
+            else:
+                removed.extend(entry_id for entry_id, _, _ in entries[i1:i2])
+                removed_songs.extend(song_id for _, song_id, _ in entries[i1:i2])
+                final.extend((None, song_id, None) for song_id in song_ids[j1:j2])
+
+        positions = _fill_gaps([position for _, _, position in final])
+        if positions is None:
+            # Không đủ chỗ giữa hai bài giữ lại: đánh số lại toàn bộ
+            positions = [index * POSITION_GAP for index in range(1, len(final) + 1)]
+            moved = [
+                PlaylistEntry(pk=entry_id, position=position)
+                for (entry_id, _, old), position in zip(final, positions)
+                if entry_id is not None and old != position
+            ]
+        else:
+            moved = []
+
+        if removed:
+            PlaylistEntry.objects.filter(pk__in=removed).delete()
+        if moved:
+            PlaylistEntry.objects.bulk_update(moved, ['position'], batch_size=1000)
+        added = [
+            PlaylistEntry(playlist_id=playlist_id, song_id=song_id, position=position)
+            for (entry_id, song_id, _), position in zip(final, positions)
+            if entry_id is None
+        ]
+        PlaylistEntry.objects.bulk_create(added, batch_size=1000)
+        if added or removed:
+            _adjust(playlist_id, added=[entry.song_id for entry in added], removed=removed_songs)
+        return len(added), len(removed)
+
+
+def _fill_gaps(positions):
+    """Replace each run of ``None`` with evenly spaced positions between its
+    known neighbours; return ``None`` if some gap is too small."""
+    result = list(positions)
+    index = 0
+    while index < len(result):
+        if result[index] is not None:
+            index += 1
+            continue
+        end = index
+        while end < len(result) and result[end] is None:
+            end += 1
+        low = result[index - 1] if index else None
+        high = result[end] if end < len(result) else None
+        count = end - index
+        if low is None and high is None:
+            run = [n * POSITION_GAP for n in range(1, count + 1)]
+        elif high is None:
+            run = [low + n * POSITION_GAP for n in range(1, count + 1)]
+        elif low is None:
+            run = [high - n * POSITION_GAP for n in range(count, 0, -1)]
+        else:
+            step = (high - low) // (count + 1)
+            if step < 1:
+                return None
+            run = [low + n * step for n in range(1, count + 1)]
+        result[index:end] = run
+        index = end
+    return result
@@ -0,0 +1,309 @@
+"""Online presence for chat users.
+
+Each websocket connection registers its channel with the presence store
+configured by ``CHAT_PRESENCE_STORE``. A user is online while at least one
+of their channels has an unexpired entry. Every worker refreshes the
+entries of its own connections every ``CHAT_PRESENCE_HEARTBEAT`` seconds
+(one batched call per worker, not one timer per connection), so the
+channels of a crashed worker expire after ``CHAT_PRESENCE_TTL`` seconds and
+the next sweep reports their users as offline.
+
+Presence changes are not broadcast: they are sent only to the
+``CHAT_PRESENCE_PEERS`` most recent conversation partners of the user
+(``ConversationSummary``, cached for ``CHAT_PRESENCE_PEERS_TTL`` seconds),
+via their ``chat_<id>`` groups.
+
+``InMemoryPresenceStore`` keeps state in the current process (tests, a
+single worker); ``RedisPresenceStore`` shares it between daphne workers.
+"""
+import asyncio
+import functools
+import logging
+import time
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.module_loading import import_string
+
+from .channel_layers import group_send_many
+from .chat_auth import TTLCache
+from .models import ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+peer_cache = TTLCache(getattr(settings, 'CHAT_PRESENCE_PEERS_CACHE_SIZE', 10000))
+
+
+def presence_ttl():
+    return getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+
+
+def heartbeat_interval():
+    return getattr(settings, 'CHAT_PRESENCE_HEARTBEAT', 20)
+
+
+class BasePresenceStore:
+    """Interface of presence stores; all times are ``time.time()`` seconds."""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or presence_ttl()
+
+    async def connect(self, user_id, channel_name):
+        """Register a channel; return True if the user just came online."""
+        raise NotImplementedError
+
+    async def disconnect(self, user_id, channel_name):
+        """Remove a channel; return True if the user just went offline."""
+        raise NotImplementedError
+
+    async def heartbeat(self, entries):
+        """Refresh ``(user_id, channel_name)`` pairs."""
+        raise NotImplementedError
+
+    async def online(self, user_ids):
+        """Return the subset of ``user_ids`` that is online."""
+        raise NotImplementedError
+
+    async def expire(self):
+        """Drop expired channels; return the ids of users now offline."""
+        raise NotImplementedError
+
+
+class InMemoryPresenceStore(BasePresenceStore):
+    def __init__(self, ttl=None):
+        super().__init__(ttl)
+        self._channels = {}  # user_id -> {channel_name: expires}
+
+    def _live(self, user_id, now):
+        channels = self._channels.get(user_id, {})
+        for channel_name in [c for c, expires in channels.items() if expires <= now]:
+            del channels[channel_name]
+        return channels
+
+    async def connect(self, user_id, channel_name):
+        now = time.time()
+        channels = self._live(user_id, now)
+        came_online = not channels
+        channels[channel_name] = now + self.ttl
+        self._channels[user_id] = channels
+        return came_online
+
+    async def disconnect(self, user_id, channel_name):
+        if user_id not in self._channels:
+            return False
+        channels = self._live(user_id, time.time())
+        channels.pop(channel_name, None)
+        if channels:
+            return False
+        del self._channels[user_id]
+        return True
+
+    async def heartbeat(self, entries):
+        expires = time.time() + self.ttl
+        for user_id, channel_name in entries:
+            self._channels.setdefault(user_id, {})[channel_name] = expires
+
+    async def online(self, user_ids):
+        now = time.time()
+        return {user_id for user_id in user_ids if user_id in self._channels and self._live(user_id, now)}
+
+    async def expire(self):
+        now = time.time()
+        offline = [user_id for user_id in list(self._channels) if not self._live(user_id, now)]
+        for user_id in offline:
+            del self._channels[user_id]
+        return offline
+
+
+class RedisPresenceStore(BasePresenceStore):
+    """Presence shared through Redis.
+
+    ``<prefix>:user:<id>`` is a sorted set of the user's channels scored by
+    expiry; ``<prefix>:users`` scores every user by their latest expiry so a
+    sweep only looks at candidates. Removing a user from ``<prefix>:users``
+    is the atomic claim that decides which worker reports them offline.
+    """
+
+    def __init__(self, ttl=None, url='redis://127.0.0.1:6379/0', prefix='presence'):
+        super().__init__(ttl)
+        self.url = url
+        self.prefix = prefix
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def redis(self):
+        # Client redis.asyncio gắn với event loop đã tạo ra nó
+        import redis.asyncio as redis
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.Redis.from_url(self.url)
+        return client
+
+    def _user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+
+    @property
+    def _users_key(self):
+        return f'{self.prefix}:users'
+
+    def _refresh(self, pipe, user_id, channel_name, expires):
+        key = self._user_key(user_id)
+        pipe.zadd(key, {channel_name: expires})
+        pipe.expire(key, int(self.ttl) + 1)
+        pipe.zadd(self._users_key, {user_id: expires})
+
+    async def connect(self, user_id, channel_name):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zremrangebyscore(self._user_key(user_id), 0, now)
+        pipe.zcard(self._user_key(user_id))
+        self._refresh(pipe, user_id, channel_name, now + self.ttl)
+        results = await pipe.execute()
+        return results[1] == 0
+
+    async def disconnect(self, user_id, channel_name):
+        key = self._user_key(user_id)
+        pipe = self.redis.pipeline()
+        pipe.zrem(key, channel_name)
+        pipe.zremrangebyscore(key, 0, time.time())
+        pipe.zcard(key)
+        if (await pipe.execute())[2]:
+            return False
+        return bool(await self.redis.zrem(self._users_key, user_id))
+
+    async def heartbeat(self, entries):
+        if not entries:
+            return
+        expires = time.time() + self.ttl
+        pipe = self.redis.pipeline()
+        for user_id, channel_name in entries:
+            self._refresh(pipe, user_id, channel_name, expires)
+        await pipe.execute()
+
+    async def online(self, user_ids):
+        user_ids = list(user_ids)
+        now = time.time()
+        pipe = self.redis.pipeline()
+        for user_id in user_ids:
+            pipe.zcount(self._user_key(user_id), f'({now}', '+inf')
+        counts = await pipe.execute()
+        return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+    async def expire(self):
+        now = time.time()
+        candidates = await self.redis.zrangebyscore(self._users_key, 0, now)
+        offline = []
+        for member in candidates:
+            user_id = int(member)
+            if await self.redis.zcount(self._user_key(user_id), f'({now}', '+inf'):
+                continue
+            if await self.redis.zrem(self._users_key, user_id):
+                offline.append(user_id)
+        return offline
+
+
+@functools.lru_cache(maxsize=None)
+def get_store():
+    """Return the process-wide store; ``get_store.cache_clear()`` rebuilds it."""
+    store_class = import_string(getattr(settings, 'CHAT_PRESENCE_STORE', 'api.presence.InMemoryPresenceStore'))
+    return store_class(**getattr(settings, 'CHAT_PRESENCE_STORE_OPTIONS', {}))
+
+
+@database_sync_to_async
+def _fetch_peers(user_id):
+    limit = getattr(settings, 'CHAT_PRESENCE_PEERS', 100)
+    return list(
+        ConversationSummary.objects.filter(user_id=user_id).exclude(peer_id=user_id)
+        .order_by('-last_message_at').values_list('peer_id', 'peer__username')[:limit]
+    )
+
+
+async def recent_peers(user_id):
+    """Return ``(id, username)`` of the user's most recent conversation partners."""
+    # Cache ngắn để reconnect hàng loạt không truy vấn DB cho mỗi kết nối
+    peers = peer_cache.get(user_id)
+    if peers is None:
+        peers = await _fetch_peers(user_id)
+        peer_cache.set(user_id, peers, getattr(settings, 'CHAT_PRESENCE_PEERS_TTL', 30))
+    return peers
+
+
+@database_sync_to_async
+def _usernames(user_ids):
+    return dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+
+
+async def notify(channel_layer, user_id, username, online):
+    peers = await recent_peers(user_id)
+    if peers:
+        await group_send_many(
+            channel_layer,
+            [f'chat_{peer_id}' for peer_id, _ in peers],
+            {'type': 'chat_presence', 'user': username, 'user_id': user_id, 'online': online},
+        )
+
+
+class PresenceTracker:
+    """Presence of the connections served by one event loop."""
+
+    def __init__(self):
+        self._channels = {}  # channel_name -> user_id
+        self._task = None
+        self._channel_layer = None
+
+    async def join(self, channel_layer, user, channel_name):
+        self._channel_layer = channel_layer
+        self._channels[channel_name] = user.id
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        if await get_store().connect(user.id, channel_name):
+            await notify(channel_layer, user.id, user.username, True)
+
+    async def online_peers(self, user_id):
+        """Return ``(id, username)`` of the user's recent peers that are online."""
+        peers = await recent_peers(user_id)
+        online = await get_store().online(peer_id for peer_id, _ in peers)
+        return [(peer_id, username) for peer_id, username in peers if peer_id in online]
+
+    async def leave(self, channel_layer, user, channel_name):
+        self._channels.pop(channel_name, None)
+        if not self._channels and self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if await get_store().disconnect(user.id, channel_name):
+            await notify(channel_layer, user.id, user.username, False)
+
+    async def tick(self):
+        """Refresh this loop's connections and report expired users."""
+        store = get_store()
+        await store.heartbeat([(user_id, channel_name) for channel_name, user_id in self._channels.items()])
+        offline = await store.expire()
+        if offline:
+            usernames = await _usernames(offline)
+            for user_id in offline:
+                await notify(self._channel_layer, user_id, usernames.get(user_id), False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(heartbeat_interval())
+            try:
+                await self.tick()
+            except Exception:
+                # Lỗi tạm thời (Redis, channel layer) không được dừng heartbeat:
+                # nếu không mọi kết nối của worker sẽ hết hạn và bị báo offline
+                logger.exception('Presence heartbeat failed')
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_tracker():
+    """Return the tracker bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        tracker = _trackers[loop] = PresenceTracker()
+    return tracker
@@ -0,0 +1,71 @@
+"""Read-through cache for serialized catalog responses.
+
+Each cached response is keyed by its absolute URL plus the current version
+of every model it depends on. Bumping a model's version (see
+``api.signals``) makes all dependent entries unreachable at once; they then
+expire on their own. Version counters must live in a cache shared by every
+worker for invalidation to reach all of them, so point
+``CATALOG_CACHE_ALIAS`` at a Redis/Memcached cache in multi-process setups.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _version_key(name):
+    return f'catalog:version:{name}'
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Giá trị khởi tạo theo thời gian để không trùng phiên bản cũ đã bị xóa khỏi cache
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(_version_key(name))
+        except ValueError:
+            cache.set(_version_key(name), time.time_ns(), timeout=None)
+
+
+def response_key(request, names):
+    versions = '.'.join(str(v) for v in get_versions(names))
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:response:{url}:{versions}'
+
+
+class CachedResponseMixin:
+    """Cache successful GET responses of a generic view.
+
+    ``cache_models`` lists the catalog models ('song', 'album', 'artist')
+    whose changes must invalidate the response.
+    """
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = response_key(request, self.cache_models)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+            cache.set(key, response.data, timeout)
+        return response
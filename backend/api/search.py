@@ -0,0 +1,206 @@
+"""Song search index.
+
+Each Song keeps a normalized ``search_document`` (title, artist names and
+album title). On MySQL the column carries a FULLTEXT index and searches use
+``MATCH ... AGAINST``. Other databases use an in-process inverted index that
+is built on first use and kept up to date by the signals in ``api.signals``.
+"""
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Song
+
+TITLE_WEIGHT = 3
+ARTIST_WEIGHT = 2
+ALBUM_WEIGHT = 1
+
+# InnoDB bỏ qua các từ ngắn hơn innodb_ft_min_token_size (mặc định 3)
+MYSQL_MIN_TOKEN_SIZE = 3
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    text = (text or '').lower().replace('đ', 'd')
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def song_fields(song):
+    """Return ``(text, weight)`` pairs for the searchable parts of a song.
+
+    ``song`` should have ``artists`` prefetched and ``album`` selected.
+    """
+    fields = [(song.title, TITLE_WEIGHT)]
+    fields += [(artist.name, ARTIST_WEIGHT) for artist in song.artists.all()]
+    if song.album is not None:
+        fields.append((song.album.title, ALBUM_WEIGHT))
+    return fields
+
+
+def build_document(song):
+    return ' '.join(token for text, _ in song_fields(song) for token in tokenize(text))
+
+
+class InvertedIndex:
+    """Token -> {song_id: weight} postings with idf ranking.
+
+    Query tokens are ANDed; the last token also matches as a prefix so
+    partially typed words still find results.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._docs = {}
+        self._vocabulary = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, song_id, fields):
+        weights = {}
+        for text, weight in fields:
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0), weight)
+        with self._lock:
+            self._remove(song_id)
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    self._postings[token] = {}
+                    self._vocabulary = None
+                self._postings[token][song_id] = weight
+            self._docs[song_id] = list(weights)
+
+    def remove(self, song_id):
+        with self._lock:
+            self._remove(song_id)
+
+    def _remove(self, song_id):
+        for token in self._docs.pop(song_id, ()):
+            postings = self._postings[token]
+            postings.pop(song_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _expand_prefix(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, prefix)
+        tokens = []
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            tokens.append(vocabulary[i])
+            i += 1
+        return tokens
+
+    def search(self, query, limit=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            total = len(self._docs) or 1
+            groups = [[token] for token in tokens[:-1]]
+            groups.append(self._expand_prefix(tokens[-1]))
+            scores = None
+            for group in groups:
+                group_scores = {}
+                for token in group:
+                    postings = self._postings.get(token, {})
+                    idf = math.log(1 + total / len(postings)) if postings else 0
+                    for song_id, weight in postings.items():
+                        score = weight * idf
+                        if score > group_scores.get(song_id, 0):
+                            group_scores[song_id] = score
+                if scores is None:
+                    scores = group_scores
+                else:
+                    scores = {
+                        song_id: score + group_scores[song_id]
+                        for song_id, score in scores.items()
+                        if song_id in group_scores
+                    }
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [song_id for song_id, _ in ranked[:limit]]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_local_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = InvertedIndex()
+                songs = Song.objects.select_related('album').prefetch_related('artists')
+                for song in songs.iterator(chunk_size=2000):
+                    index.add(song.id, song_fields(song))
+                _index = index
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def use_fulltext():
+    return connection.vendor == 'mysql'
+
+
+def reindex_songs(song_ids):
+    """Refresh the stored document and the local index for the given songs."""
+    songs = list(
+        Song.objects.filter(id__in=list(song_ids))
+        .select_related('album')
+        .prefetch_related('artists')
+    )
+    for song in songs:
+        song.search_document = build_document(song)
+        if _index is not None:
+            _index.add(song.id, song_fields(song))
+    Song.objects.bulk_update(songs, ['search_document'], batch_size=500)
+
+
+def unindex_song(song_id):
+    if _index is not None:
+        _index.remove(song_id)
+
+
+def _fulltext_search(query, limit):
+    tokens = [t for t in tokenize(query) if len(t) >= MYSQL_MIN_TOKEN_SIZE]
+    if not tokens:
+        return list(
+            Song.objects.filter(search_document__icontains=normalize(query).strip())
+            .order_by('id').values_list('id', flat=True)[:limit]
+        )
+    terms = ' '.join(f'+{t}' for t in tokens[:-1]) + f' +{tokens[-1]}*'
+    relevance = RawSQL('MATCH(search_document) AGAINST (%s IN BOOLEAN MODE)', (terms,))
+    return list(
+        Song.objects.annotate(relevance=relevance)
+        .filter(relevance__gt=0)
+        .order_by('-relevance', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def search_songs(query, limit=20):
+    """Return song ids matching ``query``, best match first."""
+    if use_fulltext():
+        return _fulltext_search(query, limit)
+    return get_local_index().search(query, limit)
@@ -0,0 +1,94 @@
+"""Bounded outbound queue for one websocket connection.
+
+Channel layer handlers only enqueue frames; a single sender task writes
+them to the socket, so a slow client no longer blocks its consumer from
+draining the channel layer. Frames enqueued with a ``key`` replace a
+queued frame with the same key (e.g. presence of one user), everything
+else is kept in order. When the queue holds ``CHAT_SEND_QUEUE_SIZE``
+frames the ``CHAT_SEND_OVERFLOW`` policy applies: ``'drop_oldest'``
+discards the oldest queued frame, ``'disconnect'`` closes the connection.
+The sender hands up to ``CHAT_SEND_BATCH_MAX`` queued frames at a time to
+``send_batch`` so the consumer can combine them into one websocket frame.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .chat_logging import log_event
+from .metrics import metrics
+
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class SendQueue:
+    def __init__(self, send_batch, on_overflow=None, maxsize=None, max_batch=None, overflow=None, log_fields=None):
+        self.send_batch = send_batch
+        self.on_overflow = on_overflow
+        self.log_fields = log_fields or {}
+        self.maxsize = maxsize or getattr(settings, 'CHAT_SEND_QUEUE_SIZE', 256)
+        self.max_batch = max_batch or getattr(settings, 'CHAT_SEND_BATCH_MAX', 50)
+        self.overflow = overflow or getattr(settings, 'CHAT_SEND_OVERFLOW', 'drop_oldest')
+        self._entries = deque()  # [key, frame, received_at]
+        self._keyed = {}
+        self._ready = asyncio.Event()
+        self._overflowed = False
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, frame, key=None, received_at=None):
+        if self._overflowed:
+            return
+        if key is not None and key in self._keyed:
+            # Gộp: chỉ giữ trạng thái mới nhất, giữ nguyên vị trí trong hàng đợi
+            entry = self._keyed[key]
+            entry[1], entry[2] = frame, received_at
+            return
+        if len(self._entries) >= self.maxsize:
+            metrics.increment('chat.send_queue_overflow')
+            if self.overflow == 'disconnect':
+                self._overflowed = True
+                if self.on_overflow is not None:
+                    self.on_overflow()
+                return
+            old_key = self._entries.popleft()[0]
+            if old_key is not None:
+                del self._keyed[old_key]
+        entry = [key, frame, received_at]
+        self._entries.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        metrics.observe('chat.send_queue_depth', len(self._entries), buckets=DEPTH_BUCKETS)
+        self._ready.set()
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            batch = []
+            while self._entries and len(batch) < self.max_batch:
+                entry = self._entries.popleft()
+                if entry[0] is not None:
+                    del self._keyed[entry[0]]
+                batch.append(entry)
+            if not self._entries:
+                self._ready.clear()
+            await self.send_batch([frame for _, frame, _ in batch])
+            now = time.time()
+            for _, _, received_at in batch:
+                if received_at is not None:
+                    # Độ trễ từ lúc server nhận tới lúc gửi xuống client, tính bằng ms
+                    latency_ms = (now - received_at) * 1000
+                    metrics.observe('chat.delivery_latency_ms', latency_ms)
+                    log_event('chat.message_delivered', logging.DEBUG, latency_ms=round(latency_ms, 3), **self.log_fields)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            # Socket đã đóng: các frame còn lại không gửi được nữa
+            pass
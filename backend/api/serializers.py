@@ -1,9 +1,29 @@
 from rest_framework import serializers
-from .models import Artist, Album, Song, Playlist, Message
+from .models import Artist, Album, Song, Playlist, PlaylistEntry, Message, ConversationSummary
+from .audio_probe import probe_duration
+from . import playlists
+from .thumbnails import SIZES as IMAGE_SIZES
+from django.urls import reverse
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+import hashlib
 import re
 from datetime import timedelta
 
+def image_urls(obj, kind, context, ext='webp'):
+    # Link tới ảnh thu nhỏ theo từng kích thước, để danh sách không phải tải ảnh gốc
+    if not obj.image:
+        return None
+    request = context.get('request')
+    # ?v= đổi khi ảnh gốc đổi, để client/CDN không giữ ảnh thu nhỏ cũ (max-age 1 ngày)
+    version = hashlib.sha1(obj.image.name.encode()).hexdigest()[:12]
+    urls = {}
+    for size in IMAGE_SIZES:
+        url = reverse('image-derivative', kwargs={'kind': kind, 'pk': obj.pk, 'size': size, 'ext': ext}) + f'?v={version}'
+        urls[size] = request.build_absolute_uri(url) if request else url
+    return urls
+
 class ArtistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Artist
@@ -12,11 +32,15 @@ class ArtistSerializer(serializers.ModelSerializer):
 class AlbumSerializer(serializers.ModelSerializer):
     # artist = ArtistSerializer(read_only=True)
     artist = serializers.PrimaryKeyRelatedField(queryset=Artist.objects.all())
+    image_urls = serializers.SerializerMethodField()
     
     class Meta:
         model = Album
         fields = '__all__'
 
+    def get_image_urls(self, obj):
+        return image_urls(obj, 'album', self.context)
+
 
 class SongSerializer(serializers.ModelSerializer):
     artists = ArtistSerializer(many=True, read_only=True)
@@ -39,12 +63,24 @@ class SongSerializer(serializers.ModelSerializer):
     audio_file = serializers.FileField(required=False, allow_null=True)
     duration = serializers.CharField(required=False, allow_blank=True, allow_null=True)
     video_file = serializers.FileField(required=False, allow_null=True)
+    hls_url = serializers.SerializerMethodField()
+    image_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = Song
-        fields = ['id', 'title', 'duration', 'artists', 'album', 'artist_ids', 'album_id', 'image', 'audio_file', 'video_file']
+        fields = ['id', 'title', 'duration', 'artists', 'album', 'artist_ids', 'album_id', 'image', 'audio_file', 'video_file', 'hls_url', 'image_urls']
         read_only_fields = ['id', 'artists', 'album']
 
+    def get_image_urls(self, obj):
+        return image_urls(obj, 'song', self.context)
+
+    def get_hls_url(self, obj):
+        if not obj.hls_manifest:
+            return None
+        url = default_storage.url(obj.hls_manifest)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def validate_duration(self, value):
         if not value:
             return None  # Allow empty/null duration
@@ -75,6 +111,12 @@ class SongSerializer(serializers.ModelSerializer):
         artist_ids = validated_data.pop('artists', [])
         album = validated_data.pop('album', None)
         duration = validated_data.pop('duration', None)
+        if duration is None and validated_data.get('audio_file'):
+            # Tự tính thời lượng từ header của file audio
+            duration = probe_duration(validated_data['audio_file'])
+        if duration is None:
+            # Song.duration không cho phép NULL: báo lỗi thay vì IntegrityError
+            raise serializers.ValidationError({'duration': 'Could not read the duration from the audio file; please provide it (HH:MM:SS).'})
         song = Song.objects.create(**validated_data, duration=duration)
         if artist_ids:
             song.artists.set(artist_ids)
@@ -87,6 +129,8 @@ class SongSerializer(serializers.ModelSerializer):
         artist_ids = validated_data.pop('artists', None)
         album = validated_data.pop('album', None)
         duration = validated_data.pop('duration', None)
+        if duration is None and validated_data.get('audio_file'):
+            duration = probe_duration(validated_data['audio_file'])
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         if duration is not None:
@@ -98,8 +142,25 @@ class SongSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+def playlist_covers(obj, context):
+    request = context.get('request')
+    urls = [default_storage.url(name) for name in obj.covers]
+    return [request.build_absolute_uri(url) for url in urls] if request else urls
+
+class PlaylistSummarySerializer(serializers.ModelSerializer):
+    # Danh sách playlist: chỉ đọc các trường tổng hợp, không serialize bài hát
+    covers = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Playlist
+        fields = ['id', 'name', 'user', 'created_at', 'version', 'song_count', 'total_duration', 'covers']
+
+    def get_covers(self, obj):
+        return playlist_covers(obj, self.context)
+
 class PlaylistSerializer(serializers.ModelSerializer):
-    songs = SongSerializer(many=True, read_only=True)
+    # Theo thứ tự trong playlist (PlaylistEntry.position)
+    songs = SongSerializer(many=True, read_only=True, source='ordered_songs')
     # user = serializers.PrimaryKeyRelatedField(read_only=True)
     song_ids = serializers.PrimaryKeyRelatedField(
         many=True,
@@ -108,32 +169,91 @@ class PlaylistSerializer(serializers.ModelSerializer):
         source='songs',
         required=False
     )
+    covers = serializers.SerializerMethodField()
 
     class Meta:
         model = Playlist
-        fields = ['id', 'name', 'user', 'songs', 'song_ids', 'created_at']
+        fields = ['id', 'name', 'user', 'songs', 'song_ids', 'created_at', 'version', 'song_count', 'total_duration', 'covers']
+        read_only_fields = ['version', 'song_count', 'total_duration']
+
+    def get_covers(self, obj):
+        return playlist_covers(obj, self.context)
 
     def create(self, validated_data):
         song_ids = validated_data.pop('songs', [])
         playlist = Playlist.objects.create(**validated_data)
         if song_ids:
-            playlist.songs.set(song_ids)
+            playlists.append(playlist.pk, [song.pk for song in song_ids])
+            playlist.refresh_from_db(fields=['version', 'song_count', 'total_duration', 'covers'])
         return playlist
 
     def update(self, instance, validated_data):
         song_ids = validated_data.pop('songs', None)
         instance.name = validated_data.get('name', instance.name)
-        instance.save()
+        instance.version = F('version') + 1
+        # Không ghi lại song_count/total_duration/covers đã đọc (có thể đã cũ)
+        instance.save(update_fields=['name', 'version'])
         if song_ids is not None:
-            instance.songs.set(song_ids)
+            # Chỉ xóa/chèn phần khác biệt thay vì ghi lại toàn bộ playlist
+            playlists.replace(instance.pk, [song.pk for song in song_ids])
+        instance.refresh_from_db(fields=['version', 'song_count', 'total_duration', 'covers'])
         return instance
 
+class PlaylistChangesSerializer(serializers.Serializer):
+    # Thêm/xóa nhiều bài trong một transaction (PlaylistSongsBulkAPI)
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=10000)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=10000)
+
+    def validate_add(self, value):
+        missing = set(value) - set(Song.objects.filter(pk__in=set(value)).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f'Song not found: {sorted(missing)}')
+        return value
+
+class PlaylistEntryCreateSerializer(serializers.Serializer):
+    # Thêm một bài (PlaylistEntriesAPI); không có "after" thì thêm vào cuối
+    song_id = serializers.IntegerField()
+    after = serializers.IntegerField(allow_null=True, required=False)
+
+class PlaylistEntryMoveSerializer(serializers.Serializer):
+    # Di chuyển một bài (PlaylistEntryDetailAPI); null là lên đầu
+    after = serializers.IntegerField(allow_null=True)
+
+class AlbumSongsSerializer(serializers.Serializer):
+    # Danh sách bài hát mới của album (AddSongToAlbumView)
+    song_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=10000)
+
+class PlaylistEntrySerializer(serializers.ModelSerializer):
+    song = SongSerializer(read_only=True)
+
+    class Meta:
+        model = PlaylistEntry
+        fields = ['id', 'position', 'song', 'added_at']
+
 class UserSerializer(serializers.ModelSerializer):
-    playlists = PlaylistSerializer(many=True, read_only=True)
+    playlists = PlaylistSerializer(many=True, read_only=True, source='playlist_set')
 
     class Meta:
         model = User
-        fields = '__all__'
+        fields = ['id', 'username', 'first_name', 'last_name', 'playlists']
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    # Dùng cho danh sách user trong chat, không kèm playlist
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+
+class RecentChatSerializer(serializers.ModelSerializer):
+    # Giữ các trường của UserSummarySerializer để frontend dùng như danh sách user
+    id = serializers.IntegerField(source='peer.id', read_only=True)
+    username = serializers.CharField(source='peer.username', read_only=True)
+    first_name = serializers.CharField(source='peer.first_name', read_only=True)
+    last_name = serializers.CharField(source='peer.last_name', read_only=True)
+    last_sender = serializers.CharField(source='last_sender.username', read_only=True, default=None)
+
+    class Meta:
+        model = ConversationSummary
+        fields = ['id', 'username', 'first_name', 'last_name', 'last_message', 'last_sender', 'last_message_at', 'unread_count', 'last_read_at']
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = serializers.CharField(source='sender.username', read_only=True)
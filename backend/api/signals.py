@@ -0,0 +1,177 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Artist, Album, Song, Playlist, PlaylistEntry, Message
+from . import search, autocomplete, response_cache, hls, conversations, playlists
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.reindex_songs([instance.id])
+    hls.schedule_ingest(instance)
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    search.unindex_song(instance.id)
+    hls.remove_files(instance.id)
+
+
+@receiver(m2m_changed, sender=Song.artists.through)
+def song_artists_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        song_ids = [instance.id]
+    elif pk_set:
+        song_ids = pk_set
+    else:
+        song_ids = getattr(instance, '_search_song_ids', [])
+    search.reindex_songs(song_ids)
+    # Nghệ sĩ hiển thị trong chi tiết playlist: đổi version (ETag)
+    playlists.touch_songs(song_ids)
+
+
+@receiver(m2m_changed, sender=Song.artists.through)
+def artist_songs_before_clear(sender, instance, action, reverse, **kwargs):
+    # artist.song_set.clear() không gửi pk_set, nên ghi lại danh sách trước khi xóa
+    if action == 'pre_clear' and reverse:
+        instance._search_song_ids = list(instance.song_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Artist)
+def artist_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    song_ids = list(instance.song_set.values_list('id', flat=True))
+    search.reindex_songs(song_ids)
+    playlists.touch_songs(song_ids)
+
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    search.reindex_songs(instance.song_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Artist)
+@receiver(pre_delete, sender=Album)
+def remember_songs_before_delete(sender, instance, **kwargs):
+    # Quan hệ bị xóa/SET_NULL bằng query trực tiếp, không có signal cho từng Song
+    instance._search_song_ids = list(instance.song_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def reindex_songs_after_delete(sender, instance, **kwargs):
+    search.reindex_songs(getattr(instance, '_search_song_ids', []))
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def catalog_deleted_in_playlists(sender, instance, **kwargs):
+    song_ids = getattr(instance, '_search_song_ids', [])
+    if sender is Album:
+        # Bài không còn album: ảnh bìa playlist lấy lại từ ảnh của bài
+        playlists.touch_covers(PlaylistEntry.objects.filter(song_id__in=song_ids).order_by().values_list('playlist_id', flat=True))
+    else:
+        playlists.touch_songs(song_ids)
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+def autocomplete_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.update(instance)
+
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def autocomplete_deleted(sender, instance, **kwargs):
+    autocomplete.remove(instance)
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+def invalidate_catalog_cache(sender, **kwargs):
+    # Sau commit: nếu tăng version sớm hơn, request khác có thể cache lại dữ liệu cũ
+    name = sender._meta.model_name
+    transaction.on_commit(lambda: response_cache.invalidate(name))
+
+
+@receiver(m2m_changed, sender=Song.artists.through)
+def invalidate_song_artists_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: response_cache.invalidate('song'))
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    # Tin nhắn ghi theo lô (bulk_create) được chat_writer tự cập nhật
+    if created and not raw:
+        conversations.record_messages([instance])
+
+
+@receiver(m2m_changed, sender=Playlist.songs.through)
+def playlist_songs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # songs.add() tạo PlaylistEntry chưa có vị trí: xếp vào cuối playlist
+    if action == 'post_add' and pk_set:
+        playlists.fill_positions(pk_set if reverse else [instance.pk])
+    elif action == 'post_remove' and pk_set:
+        playlists.touch(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        # song.playlist_set.clear() không gửi pk_set: ghi lại các playlist bị ảnh hưởng
+        instance._playlist_ids = playlists.song_playlists(instance.pk)
+    elif action == 'post_clear':
+        playlists.touch(getattr(instance, '_playlist_ids', ()) if reverse else [instance.pk])
+
+
+@receiver(pre_save, sender=Song)
+def remember_playlist_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Giá trị cũ để post_save chỉ áp dụng phần thay đổi lên tổng hợp của playlist
+    if raw or instance.pk is None:
+        return
+    instance._playlist_fields = (
+        Song.objects.filter(pk=instance.pk).values_list('duration', 'image', 'album_id').first()
+    )
+
+
+@receiver(post_save, sender=Song)
+def song_changed_in_playlists(sender, instance, created, raw=False, **kwargs):
+    # Playlist chứa bài này trả về dữ liệu khác: đổi version (ETag)
+    old = getattr(instance, '_playlist_fields', None)
+    if raw or created or old is None:
+        return
+    duration, image, album_id = old
+    duration_delta = instance.duration - duration if duration is not None and instance.duration is not None else None
+    cover_changed = (image or '') != (instance.image.name or '') or album_id != instance.album_id
+    playlists.song_changed(instance.pk, duration_delta, cover_changed)
+
+
+@receiver(pre_delete, sender=Song)
+def remember_playlists_before_delete(sender, instance, **kwargs):
+    # PlaylistEntry bị xóa theo CASCADE, không có signal m2m
+    instance._playlist_ids = playlists.song_playlists(instance.pk)
+
+
+@receiver(post_delete, sender=Song)
+def song_removed_from_playlists(sender, instance, **kwargs):
+    playlists.touch(getattr(instance, '_playlist_ids', ()))
+
+
+@receiver(post_save, sender=Album)
+def album_cover_in_playlists(sender, instance, created, raw=False, **kwargs):
+    # Ảnh bìa album nằm trong Playlist.covers
+    if raw or created:
+        return
+    playlists.touch_covers(PlaylistEntry.objects.filter(song__album=instance).order_by().values_list('playlist_id', flat=True).distinct())
@@ -0,0 +1,128 @@
+"""Byte-range and conditional responses for uploaded media files."""
+import mimetypes
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(size, mtime):
+    return quote_etag(f'{size:x}-{int(mtime * 1000):x}')
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single byte range.
+
+    Returns ``None`` when the header should be ignored (absent, malformed or
+    multi-range) and ``False`` when the range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.replace(' ', '')) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_chunks(f, remaining):
+    try:
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _aread_chunks(f, remaining):
+    try:
+        while remaining > 0:
+            chunk = await sync_to_async(f.read, thread_sensitive=False)(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(f.close, thread_sensitive=False)()
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def serve_file(request, storage, name, cache_control='public, max-age=86400'):
+    """Serve a stored file with Range, ETag and Last-Modified support.
+
+    Full responses under WSGI go through ``FileResponse`` so the server can
+    use ``wsgi.file_wrapper``/sendfile; under ASGI (daphne) the file is
+    streamed by an async iterator reading fixed-size chunks off the event
+    loop.
+    """
+    size = storage.size(name)
+    mtime = storage.get_modified_time(name).timestamp()
+    etag = file_etag(size, mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control,
+    }
+
+    if _not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range is not None:
+        if if_range.strip() != etag and parse_http_date_safe(if_range) != int(mtime):
+            byte_range = None
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    is_asgi = isinstance(request, ASGIRequest)
+    f = storage.open(name, 'rb')
+
+    if byte_range is None:
+        if is_asgi:
+            response = StreamingHttpResponse(_aread_chunks(f, size), content_type=content_type)
+        else:
+            response = FileResponse(f, content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        f.seek(start)
+        chunks = _aread_chunks(f, length) if is_asgi else _read_chunks(f, length)
+        response = StreamingHttpResponse(chunks, status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
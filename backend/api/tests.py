@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import asyncio
+import os
+import io
+import json
+import logging
+import shutil
+import tempfile
+import wave
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.utils import timezone
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Artist, Album, Song, Playlist, Message, ConversationSummary
+from .consumers import ChatConsumer
+from .views import PlaylistDetailAPI
+from .chat_writer import MessageWriter, user_cache, get_writer
+from .chat_auth import JWTAuthMiddleware
+from .chat_logging import JSONFormatter, QueueStreamHandler
+from .metrics import metrics
+from .send_queue import SendQueue
+from . import chat_auth
+from .conversations import mark_read
+from .audio_probe import probe_duration
+from . import search, autocomplete, hls, presence, playlists, response_cache
+
+
+class SongQueryCountTests(TestCase):
+    def setUp(self):
+        search.reset_index()
+        cache.clear()
+        self.client = APIClient()
+        self.artist = Artist.objects.create(name='Artist')
+        self.album = Album.objects.create(title='Album', artist=self.artist)
+
+    def add_songs(self, count):
+        for i in range(count):
+            song = Song.objects.create(
+                title=f'Song {Song.objects.count()}',
+                album=self.album,
+                duration=timedelta(minutes=3),
+            )
+            song.artists.add(self.artist)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_constant_queries(self, url):
+        self.add_songs(2)
+        self.client.get(url)
+        small = self.count_queries(url)
+        self.add_songs(15)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_song_list(self):
+        self.assert_constant_queries('/api/songs/')
+
+    def test_album_songs(self):
+        self.assert_constant_queries(f'/api/albums/{self.album.id}/songs/')
+
+    def test_search(self):
+        self.assert_constant_queries('/api/search/?q=Song')
+
+
+class SongSearchTests(TestCase):
+    def setUp(self):
+        search.reset_index()
+        cache.clear()
+        self.client = APIClient()
+        self.artist = Artist.objects.create(name='Sơn Tùng')
+        album = Album.objects.create(title='Chúng ta', artist=self.artist)
+        self.by_title = Song.objects.create(title='Chúng ta của hiện tại', duration=timedelta(minutes=4))
+        self.by_album = Song.objects.create(title='Muộn rồi', album=album, duration=timedelta(minutes=4))
+        self.by_album.artists.add(self.artist)
+
+    def titles(self, query):
+        response = self.client.get('/api/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [song['title'] for song in response.data]
+
+    def test_ranks_title_above_album(self):
+        self.assertEqual(self.titles('chung ta'), ['Chúng ta của hiện tại', 'Muộn rồi'])
+
+    def test_prefix_of_last_word(self):
+        self.assertEqual(self.titles('son tu'), ['Muộn rồi'])
+
+    def test_artist_rename_updates_index(self):
+        self.titles('son')
+        self.artist.name = 'MTP'
+        self.artist.save()
+        self.assertEqual(self.titles('son'), [])
+        self.assertEqual(self.titles('mtp'), ['Muộn rồi'])
+
+
+class UserListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='me', password='pw')
+        self.client.force_authenticate(self.user)
+        song = Song.objects.create(title='Song', duration=timedelta(minutes=3))
+        for i in range(3):
+            other = User.objects.create_user(username=f'user{i}', password='pw')
+            Playlist.objects.create(name='Mix', user=other).songs.add(song)
+
+    def test_summary_by_default(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data[0]), {'id', 'username', 'first_name', 'last_name'})
+
+    def test_expand_playlists_is_prefetched(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/users/?expand=playlists')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[1]['playlists'][0]['songs'][0]['title'], 'Song')
+        self.assertLessEqual(len(ctx.captured_queries), 6)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for i in range(5):
+            Artist.objects.create(name=f'Artist {i}')
+
+    def test_full_list_without_cursor_params(self):
+        response = self.client.get('/api/artists/')
+        self.assertEqual(len(response.data), 5)
+
+    def test_walks_pages_in_id_order(self):
+        names = []
+        url = '/api/artists/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 2)
+            names += [a['name'] for a in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, [f'Artist {i}' for i in range(5)])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        autocomplete.reset_index()
+        self.client = APIClient()
+        self.artist = Artist.objects.create(name='Đen Vâu')
+        Song.objects.create(title='Lối nhỏ', duration=timedelta(minutes=4))
+
+    def complete(self, query):
+        response = self.client.get('/api/search/autocomplete/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['label']) for item in response.data]
+
+    def test_matches_any_word_start(self):
+        self.assertEqual(self.complete('vau'), [('artist', 'Đen Vâu')])
+        self.assertEqual(self.complete('lo'), [('song', 'Lối nhỏ')])
+
+    def test_follows_saves_and_deletes_without_queries(self):
+        self.complete('den')
+        self.artist.name = 'Den'
+        self.artist.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete.complete('den'), [{'type': 'artist', 'id': self.artist.id, 'label': 'Den'}])
+        self.artist.delete()
+        self.assertEqual(self.complete('den'), [])
+
+    def test_bulk_load_matches_incremental_puts(self):
+        items = [('song', i, f'Bài {i % 7} số {i}') for i in range(200)]
+        loaded, incremental = autocomplete.PrefixIndex(), autocomplete.PrefixIndex()
+        loaded.load(items)
+        for item in items:
+            incremental.put(*item)
+        self.assertEqual(loaded._keys, incremental._keys)
+        loaded.put('song', 3, 'Renamed')
+        self.assertEqual(loaded.complete('renamed'), [{'type': 'song', 'id': 3, 'label': 'Renamed'}])
+        self.assertEqual(loaded.complete('so 199'), [{'type': 'song', 'id': 199, 'label': 'Bài 3 số 199'}])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.artist = Artist.objects.create(name='Artist')
+        self.album = Album.objects.create(title='Album', artist=self.artist)
+        self.song = Song.objects.create(title='Song', duration=timedelta(minutes=3))
+
+    def test_second_request_is_served_from_cache(self):
+        self.client.get('/api/songs/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/songs/')
+        self.assertEqual(response.data[0]['title'], 'Song')
+
+    def test_artist_rename_invalidates_song_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.song.artists.add(self.artist)
+        self.client.get('/api/songs/')
+        versions = response_cache.get_versions(['artist'])
+        self.artist.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.artist.save()
+            # Chưa commit: version cache chưa đổi
+            self.assertEqual(response_cache.get_versions(['artist']), versions)
+        self.assertTrue(callbacks)
+        response = self.client.get('/api/songs/')
+        self.assertEqual(response.data[0]['artists'][0]['name'], 'Renamed')
+
+    def test_add_songs_to_album_invalidates_album_songs(self):
+        url = f'/api/albums/{self.album.id}/songs/'
+        self.assertEqual(self.client.get(url).data, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/albums/{self.album.id}/add_songs/', {'song_ids': [self.song.id]}, format='json')
+        self.assertEqual([s['id'] for s in self.client.get(url).data], [self.song.id])
+
+
+class SongStreamTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = APIClient()
+        self.song = Song(title='Song', duration=timedelta(minutes=3))
+        self.song.audio_file.save('track.mp3', ContentFile(bytes(range(256)) * 4), save=False)
+        self.song.save()
+        self.url = f'/api/songs/{self.song.id}/stream/audio/'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(len(self.body(response)), 1024)
+
+    def test_byte_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(self.body(response), bytes(range(10, 20)))
+
+    def test_suffix_and_unsatisfiable_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(self.body(response), bytes(range(252, 256)))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_none_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_video(self):
+        response = self.client.get(f'/api/songs/{self.song.id}/stream/video/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(HLS_SEGMENTER='api.hls.ByteSplitSegmenter', HLS_SEGMENT_SECONDS=6, HLS_INGEST_ASYNC=False)
+class HLSIngestTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def create_song(self, content, seconds):
+        song = Song(title='Song', duration=timedelta(seconds=seconds))
+        song.audio_file.save('track.mp3', ContentFile(content), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            song.save()
+        song.refresh_from_db()
+        return song
+
+    def test_segments_by_duration(self):
+        song = self.create_song(b'x' * 1000, seconds=20)
+        manifest_dir = os.path.join(self.media_root, os.path.dirname(song.hls_manifest))
+        with open(os.path.join(self.media_root, song.hls_manifest)) as f:
+            manifest = f.read()
+        self.assertEqual(manifest.count('#EXTINF'), 4)
+        self.assertIn('#EXTINF:2.000,', manifest)
+        sizes = [os.path.getsize(os.path.join(manifest_dir, n)) for n in sorted(os.listdir(manifest_dir)) if n.endswith('.mp3')]
+        self.assertEqual(sizes, [250, 250, 250, 250])
+
+    def test_new_audio_replaces_segments(self):
+        song = self.create_song(b'x' * 100, seconds=5)
+        old_manifest = song.hls_manifest
+        song.audio_file.save('other.mp3', ContentFile(b'y' * 100), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            song.save()
+        song.refresh_from_db()
+        self.assertNotEqual(song.hls_manifest, old_manifest)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, hls.song_dir(song.id))), [os.path.basename(os.path.dirname(song.hls_manifest))])
+        response = APIClient().get(f'/api/songs/{song.id}/')
+        self.assertTrue(response.data['hls_url'].endswith(song.hls_manifest))
+
+
+def make_wav(seconds, rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b'\x00\x00' * rate * seconds)
+    return buffer.getvalue()
+
+
+def make_cbr_mp3(frames):
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417-byte frames of 1152 samples
+    frame = b'\xff\xfb\x90\x00' + b'\x00' * 413
+    return b'ID3\x03\x00\x00\x00\x00\x00\x0a' + b'\x00' * 10 + frame * frames
+
+
+class AudioProbeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_wav_and_cbr_mp3(self):
+        self.assertEqual(probe_duration(io.BytesIO(make_wav(3))), timedelta(seconds=3))
+        self.assertEqual(probe_duration(io.BytesIO(make_cbr_mp3(1000))), timedelta(seconds=26))
+        self.assertIsNone(probe_duration(io.BytesIO(b'not audio')))
+
+    def test_upload_fills_duration(self):
+        artist = Artist.objects.create(name='Artist')
+        response = APIClient().post('/api/songs/', {
+            'title': 'Song',
+            'artist_ids': [artist.id],
+            'audio_file': SimpleUploadedFile('song.wav', make_wav(5), content_type='audio/wav'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['duration'], '00:00:05')
+
+    def test_unreadable_upload_without_duration_is_rejected(self):
+        response = APIClient().post('/api/songs/', {
+            'title': 'Song',
+            'audio_file': SimpleUploadedFile('song.mp3', b'not audio', content_type='audio/mpeg'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('duration', response.data)
+        self.assertFalse(Song.objects.exists())
+
+    def test_backfill_command(self):
+        song = Song(title='Song', duration=timedelta(0))
+        song.audio_file.save('song.wav', ContentFile(make_wav(4)), save=False)
+        song.save()
+        playlist = Playlist.objects.create(name='P', user=User.objects.create_user(username='u', password='pw'))
+        playlists.append(playlist.pk, [song.pk, song.pk])
+        version = Playlist.objects.get(pk=playlist.pk).version
+        call_command('backfill_durations', stdout=io.StringIO())
+        song.refresh_from_db()
+        self.assertEqual(song.duration, timedelta(seconds=4))
+        playlist.refresh_from_db()
+        self.assertEqual(playlist.total_duration, timedelta(seconds=8))
+        self.assertGreater(playlist.version, version)
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(buffer, 'PNG')
+        self.album = Album(title='Album', artist=Artist.objects.create(name='Artist'))
+        self.album.image.save('cover.png', ContentFile(buffer.getvalue()), save=False)
+        self.album.save()
+        self.client = APIClient()
+
+    def test_serializer_links_sized_derivatives(self):
+        urls = self.client.get(f'/api/albums/{self.album.id}/').data['image_urls']
+        self.assertEqual(set(urls), {'small', 'medium', 'large'})
+        response = self.client.get(urls['small'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (64, 43))
+
+    def test_replacing_image_changes_derivative_urls(self):
+        before = self.client.get(f'/api/albums/{self.album.id}/').data['image_urls']['small']
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), 'blue').save(buffer, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.album.image.save('other.png', ContentFile(buffer.getvalue()))
+        after = self.client.get(f'/api/albums/{self.album.id}/').data['image_urls']['small']
+        self.assertNotEqual(before, after)
+        self.assertIn('?v=', after)
+
+    def test_derivative_is_generated_once(self):
+        url = f'/api/images/album/{self.album.id}/medium.jpg'
+        first = self.client.get(url)
+        b''.join(first.streaming_content)
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        derived = [f for _, _, files in os.walk(os.path.join(self.media_root, 'derived')) for f in files]
+        self.assertEqual(len(derived), 1)
+        self.assertEqual(self.client.get(f'/api/images/album/{self.album.id}/huge.jpg').status_code, 404)
+
+
+class ChatLoggingTests(TestCase):
+    def test_records_are_formatted_by_the_listener(self):
+        stream = io.StringIO()
+        handler = QueueStreamHandler(stream)
+        handler.setFormatter(JSONFormatter())
+        self.assertIsInstance(handler.target.formatter, JSONFormatter)
+        record = logging.makeLogRecord({'name': 'api.chat', 'levelname': 'INFO', 'msg': 'chat.connect',
+                                        'event': 'chat.connect', 'fields': {'user_id': 1}})
+        with mock.patch.object(JSONFormatter, 'format', autospec=True, side_effect=JSONFormatter.format) as fmt:
+            prepared = handler.prepare(record)
+            self.assertEqual(fmt.call_count, 0)
+            self.assertEqual(prepared.fields, {'user_id': 1})
+            handler.emit(record)
+            handler.listener.stop()
+        self.assertEqual(fmt.call_count, 1)
+        self.assertEqual(json.loads(stream.getvalue())['user_id'], 1)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'api.channel_layers.MultiGroupInMemoryChannelLayer'}},
+    CHAT_WRITE_BATCH_SIZE=50,
+    CHAT_WRITE_FLUSH_INTERVAL=10,
+    CHAT_PRESENCE_STORE='api.presence.InMemoryPresenceStore',
+    CHAT_PRESENCE_STORE_OPTIONS={},
+)
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        user_cache.clear()
+        chat_auth.token_cache.clear()
+        chat_auth.user_cache.clear()
+        # Store được tạo theo settings của class: tạo lại trước và sau mỗi test
+        presence.get_store.cache_clear()
+        self.addCleanup(presence.get_store.cache_clear)
+        presence.peer_cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pw')
+        self.bob = User.objects.create_user(username='bob', password='pw')
+
+    def connect(self, user):
+        application = JWTAuthMiddleware(ChatConsumer.as_asgi())
+        return WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(user)}')
+
+    def test_messages_are_batched_and_flushed_on_disconnect(self):
+        async def run():
+            alice = self.connect(self.alice)
+            connected, _ = await alice.connect()
+            self.assertTrue(connected)
+            for i in range(5):
+                await alice.send_json_to({'message': f'hi {i}', 'receiver': 'bob'})
+                echo = await alice.receive_json_from()
+                self.assertEqual(echo['content'], f'hi {i}')
+            await alice.disconnect()
+
+        with CaptureQueriesContext(connection) as ctx:
+            async_to_sync(run)()
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "api_message"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('content', 'sender__username', 'receiver__username')),
+            [(f'hi {i}', 'alice', 'bob') for i in range(5)],
+        )
+        summaries = ConversationSummary.objects.order_by('user__username')
+        self.assertEqual(
+            [(s.user.username, s.peer.username, s.last_message, s.unread_count) for s in summaries],
+            [('alice', 'bob', 'hi 4', 0), ('bob', 'alice', 'hi 4', 5)],
+        )
+
+    def test_failed_batch_is_retried_and_disconnect_does_not_raise(self):
+        bulk_create = Message.objects.bulk_create
+        calls = []
+
+        def flaky(batch, *args, **kwargs):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return bulk_create(batch, *args, **kwargs)
+
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            for i in range(3):
+                await alice.send_json_to({'message': f'hi {i}', 'receiver': 'bob'})
+                await alice.receive_json_from()
+            await alice.disconnect()
+            await get_writer().flush()
+
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=flaky), \
+                self.assertLogs('api.chat_writer', 'ERROR'):
+            async_to_sync(run)()
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['hi 0', 'hi 1', 'hi 2'])
+
+    @override_settings(CHAT_WRITE_MAX_ATTEMPTS=2)
+    def test_batch_is_dropped_after_max_attempts(self):
+        async def run():
+            writer = MessageWriter()
+            writer.add(Message(sender=self.alice, receiver=self.bob, content='hi'))
+            await writer.flush()
+            self.assertEqual(len(writer._pending), 1)
+            await writer.flush()
+            self.assertEqual(writer._pending, [])
+            self.assertIsNone(writer._timer)
+
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('api.chat_writer', 'ERROR') as logs:
+            async_to_sync(run)()
+        self.assertIn('Dropping chat message', logs.output[-1])
+        self.assertFalse(Message.objects.exists())
+
+    def test_message_to_self_is_delivered_once(self):
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await alice.send_json_to({'message': 'note', 'receiver': 'alice'})
+            self.assertEqual((await alice.receive_json_from())['content'], 'note')
+            self.assertTrue(await alice.receive_nothing())
+            await alice.disconnect()
+
+        async_to_sync(run)()
+
+    def test_records_delivery_latency_and_structured_events(self):
+        metrics.reset()
+
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await alice.send_json_to({'message': 'hi', 'receiver': 'bob'})
+            await alice.receive_json_from()
+            await alice.disconnect()
+
+        with self.assertLogs('api.chat', 'INFO') as logs:
+            async_to_sync(run)()
+        self.assertEqual(metrics.snapshot()['histograms']['chat.delivery_latency_ms']['count'], 1)
+        events = [(r.event, r.fields.get('user_id')) for r in logs.records]
+        self.assertEqual(events, [('chat.connect', self.alice.id), ('chat.disconnect', self.alice.id)])
+
+    def test_read_event_moves_watermark_and_sends_receipt(self):
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            timestamps = []
+            for i in range(3):
+                await alice.send_json_to({'message': f'hi {i}', 'receiver': 'bob'})
+                timestamps.append((await alice.receive_json_from())['timestamp'])
+            await get_writer().flush()
+            bob = self.connect(self.bob)
+            await bob.connect()
+            self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'online': True})
+            await bob.send_json_to({'type': 'read', 'peer': 'alice', 'timestamp': timestamps[1]})
+            self.assertEqual(
+                await bob.receive_json_from(),
+                {'type': 'read', 'reader': 'bob', 'peer': 'alice', 'read_at': timestamps[1], 'unread_count': 1},
+            )
+            self.assertEqual(
+                await alice.receive_json_from(),
+                {'type': 'read', 'reader': 'bob', 'peer': 'alice', 'read_at': timestamps[1]},
+            )
+            # Watermark không lùi lại
+            await bob.send_json_to({'type': 'read', 'peer': 'alice', 'timestamp': timestamps[0]})
+            self.assertEqual((await bob.receive_json_from())['unread_count'], 1)
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+        summary = ConversationSummary.objects.get(user=self.bob, peer=self.alice)
+        self.assertEqual(summary.unread_count, 1)
+
+    def test_presence_is_pushed_to_recent_peers_only(self):
+        carol = User.objects.create_user(username='carol', password='pw')
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='hi')
+
+        async def run():
+            alice, carol_ws = self.connect(self.alice), self.connect(carol)
+            await alice.connect()
+            await carol_ws.connect()
+            bob = self.connect(self.bob)
+            await bob.connect()
+            self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'online': True})
+            await bob.send_json_to({'type': 'presence'})
+            self.assertEqual(await bob.receive_json_from(), {'type': 'presence', 'online': ['alice']})
+            # Tab thứ hai không đổi trạng thái online
+            bob_tab = self.connect(self.bob)
+            await bob_tab.connect()
+            await bob_tab.disconnect()
+            self.assertTrue(await alice.receive_nothing())
+            await bob.disconnect()
+            self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'online': False})
+            self.assertTrue(await carol_ws.receive_nothing())
+            await alice.disconnect()
+            await carol_ws.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(CHAT_PRESENCE_TTL=0.05)
+    def test_expired_connections_go_offline(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='hi')
+
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            # Kết nối của bob trên một worker đã chết: không còn heartbeat
+            await presence.get_store().connect(self.bob.id, 'dead-worker!channel')
+            await asyncio.sleep(0.1)
+            await presence.get_tracker().tick()
+            self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'online': False})
+            self.assertEqual(await presence.get_store().online([self.alice.id, self.bob.id]), {self.alice.id})
+            await alice.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(CHAT_PRESENCE_HEARTBEAT=0.01)
+    def test_heartbeat_survives_failing_tick(self):
+        async def run():
+            tracker = presence.PresenceTracker()
+            calls = []
+
+            async def tick():
+                calls.append(True)
+                if len(calls) == 1:
+                    raise ConnectionError('redis down')
+
+            tracker.tick = tick
+            task = asyncio.ensure_future(tracker._run())
+            with self.assertLogs('api.presence', 'ERROR'):
+                while len(calls) < 3:
+                    await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        async_to_sync(run)()
+
+    def test_batched_frames(self):
+        async def run():
+            alice = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/?token={AccessToken.for_user(self.alice)}&batch=1')
+            await alice.connect()
+            await alice.send_json_to({'message': 'hi', 'receiver': 'bob'})
+            await alice.send_json_to({'message': 'x', 'receiver': 'nobody'})
+            frames = []
+            while len(frames) < 2:
+                received = await alice.receive_json_from()
+                frames.extend(received if isinstance(received, list) else [received])
+            self.assertEqual(sorted(f.get('content', f.get('error')) for f in frames), ['Receiver not found', 'hi'])
+            await alice.disconnect()
+
+        async_to_sync(run)()
+
+    def test_compact_formats(self):
+        async def run():
+            token = AccessToken.for_user(self.alice)
+            compact = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/?token={token}&format=compact')
+            await compact.connect()
+            packed = WebsocketCommunicator(
+                JWTAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/?token={token}', subprotocols=['chat.msgpack.deflate', 'chat.json'],
+            )
+            connected, subprotocol = await packed.connect()
+            self.assertEqual((connected, subprotocol), (True, 'chat.msgpack.deflate'))
+            await packed.send_to(bytes_data=msgpack.packb({'message': 'hi', 'receiver': 'bob'}))
+            frame = await compact.receive_json_from()
+            self.assertEqual(
+                {key: frame[key] for key in ('t', 'c', 's', 'r')},
+                {'t': 'm', 'c': 'hi', 's': self.alice.id, 'r': self.bob.id},
+            )
+            self.assertIsInstance(frame['ts'], int)
+            inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = await packed.receive_from()
+            self.assertEqual(msgpack.unpackb(inflate.decompress(data + b'\x00\x00\xff\xff')), frame)
+            await compact.disconnect()
+            await packed.disconnect()
+
+        async_to_sync(run)()
+
+    def test_read_rejects_out_of_range_epoch(self):
+        async def run():
+            token = AccessToken.for_user(self.bob)
+            bob = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/?token={token}&format=compact')
+            await bob.connect()
+            for timestamp in ('1e20', '-1e20', 'NaN', 'Infinity'):
+                await bob.send_to(text_data=f'{{"type": "read", "peer": "alice", "timestamp": {timestamp}}}')
+                self.assertEqual(await bob.receive_json_from(), {'t': 'e', 'e': 'Invalid timestamp'})
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+    def test_unknown_receiver(self):
+        async def run():
+            alice = self.connect(self.alice)
+            await alice.connect()
+            await alice.send_json_to({'message': 'hi', 'receiver': 'nobody'})
+            self.assertEqual(await alice.receive_json_from(), {'error': 'Receiver not found'})
+            await alice.disconnect()
+
+        async_to_sync(run)()
+        self.assertFalse(Message.objects.exists())
+
+    def test_rejects_missing_or_invalid_token(self):
+        async def run():
+            for path in ['/ws/chat/', '/ws/chat/?token=garbage']:
+                communicator = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), path)
+                connected, _ = await communicator.connect()
+                self.assertFalse(connected)
+
+        async_to_sync(run)()
+
+    def test_reconnect_uses_cached_user(self):
+        token = str(AccessToken.for_user(self.alice))
+
+        async def connect_once():
+            communicator = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/?token={token}&v=2')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.disconnect()
+
+        async_to_sync(connect_once)()
+        with self.assertNumQueries(0):
+            async_to_sync(connect_once)()
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw')
+        self.bob = User.objects.create_user(username='bob', password='pw')
+        carol = User.objects.create_user(username='carol', password='pw')
+        Message.objects.create(sender=self.alice, receiver=carol, content='other')
+        same_time = timezone.now()
+        for i in range(7):
+            sender, receiver = (self.alice, self.bob) if i % 2 else (self.bob, self.alice)
+            Message.objects.create(sender=sender, receiver=receiver, content=str(i), timestamp=same_time if i in (3, 4) else same_time + timedelta(seconds=i))
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def get(self, **params):
+        response = self.client.get('/api/messages/bob/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_history_uses_conversation(self):
+        self.assertEqual([m['content'] for m in self.client.get('/api/messages/bob/').data], ['0', '3', '4', '1', '2', '5', '6'])
+
+    def test_scroll_back_and_forward(self):
+        latest = self.get(limit=3)
+        self.assertEqual([m['content'] for m in latest['results']], ['2', '5', '6'])
+        self.assertTrue(latest['has_more'])
+        older = self.get(limit=3, before=latest['before_cursor'])
+        self.assertEqual([m['content'] for m in older['results']], ['3', '4', '1'])
+        oldest = self.get(limit=3, before=older['before_cursor'])
+        self.assertEqual([m['content'] for m in oldest['results']], ['0'])
+        self.assertFalse(oldest['has_more'])
+        newer = self.get(limit=2, after=oldest['after_cursor'])
+        self.assertEqual([m['content'] for m in newer['results']], ['3', '4'])
+        self.assertTrue(newer['has_more'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/messages/bob/', {'before': 'nope'}).status_code, 400)
+
+    def test_single_pagination_scheme(self):
+        # cursor/page_size của CursorPagination không áp dụng cho tin nhắn
+        self.assertEqual(len(self.client.get('/api/messages/bob/', {'page_size': 2}).data), 7)
+        window = self.get(limit=2)
+        self.assertEqual(set(window), {'results', 'before_cursor', 'after_cursor', 'has_more'})
+
+
+class RecentChatsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pw')
+        self.bob = User.objects.create_user(username='bob', password='pw')
+        self.carol = User.objects.create_user(username='carol', password='pw')
+        now = timezone.now()
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='from bob', timestamp=now)
+        Message.objects.create(sender=self.carol, receiver=self.alice, content='from carol', timestamp=now + timedelta(seconds=1))
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='reply', timestamp=now + timedelta(seconds=2))
+        Message.objects.create(sender=self.alice, receiver=self.alice, content='note', timestamp=now - timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_ordered_by_latest_message(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/recent-chats/').data
+        self.assertEqual(
+            [(c['username'], c['last_message'], c['last_sender'], c['unread_count']) for c in data],
+            [('bob', 'reply', 'alice', 1), ('carol', 'from carol', 'carol', 1)],
+        )
+
+    def test_expand_playlists(self):
+        data = self.client.get('/api/recent-chats/', {'expand': 'playlists'}).data
+        self.assertEqual([(u['username'], u['playlists']) for u in data], [('bob', []), ('carol', [])])
+
+    def test_out_of_order_write_keeps_latest(self):
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='late', timestamp=timezone.now() - timedelta(hours=1))
+        summary = ConversationSummary.objects.get(user=self.alice, peer=self.bob)
+        self.assertEqual((summary.last_message, summary.unread_count), ('reply', 2))
+
+    def test_unread_after_watermark(self):
+        summary = mark_read(self.alice.id, self.bob.id, Message.objects.get(content='from bob').timestamp)
+        self.assertEqual(summary.unread_count, 0)
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='new')
+        # Tin ghi trễ, đã nằm trước watermark: không tính là chưa đọc
+        Message.objects.create(sender=self.bob, receiver=self.alice, content='late', timestamp=summary.last_read_at - timedelta(seconds=1))
+        data = self.client.get('/api/recent-chats/').data
+        self.assertEqual(data[0]['unread_count'], 1)
+        unread = self.client.get('/api/messages/bob/', {'unread': 1}).data
+        self.assertEqual([m['content'] for m in unread['results']], ['new', 'reply'])
+
+
+class SendQueueTests(TestCase):
+    def run_queue(self, frames, **options):
+        async def run():
+            sent, unblock = [], asyncio.Event()
+            overflowed = []
+
+            async def send_batch(batch):
+                await unblock.wait()
+                sent.append(batch)
+
+            queue = SendQueue(send_batch, on_overflow=lambda: overflowed.append(True), max_batch=10, **options)
+            for frame, key in frames:
+                queue.put(frame, key=key)
+            # Client chậm: chưa đọc gì, rồi mới đọc hết
+            await asyncio.sleep(0)
+            unblock.set()
+            while len(queue):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            await queue.close()
+            return sent, overflowed
+
+        return async_to_sync(run)()
+
+    def test_coalesces_keyed_frames(self):
+        sent, _ = self.run_queue([
+            ({'n': 1}, None), ({'online': True}, 'bob'), ({'n': 2}, None), ({'online': False}, 'bob'),
+        ], maxsize=10)
+        self.assertEqual(sent, [[{'n': 1}, {'online': False}, {'n': 2}]])
+
+    def test_drop_oldest_when_full(self):
+        metrics.reset()
+        sent, overflowed = self.run_queue([({'n': i}, None) for i in range(5)], maxsize=3, overflow='drop_oldest')
+        self.assertEqual(sent, [[{'n': 2}, {'n': 3}, {'n': 4}]])
+        self.assertEqual(overflowed, [])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['chat.send_queue_overflow'], 2)
+        self.assertEqual(snapshot['histograms']['chat.send_queue_depth']['max'], 3)
+
+    def test_disconnect_when_full(self):
+        sent, overflowed = self.run_queue([({'n': i}, None) for i in range(5)], maxsize=3, overflow='disconnect')
+        self.assertEqual(sent, [[{'n': 0}, {'n': 1}, {'n': 2}]])
+        self.assertEqual(overflowed, [True])
+
+
+class PlaylistEntryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='me', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.songs = [Song.objects.create(title=f'S{i}', duration=timedelta(minutes=3)) for i in range(5)]
+        self.playlist = Playlist.objects.create(name='Mix', user=self.user)
+
+    def titles(self):
+        return [entry.song.title for entry in self.playlist.entries.select_related('song')]
+
+    def test_append_insert_move_and_duplicates(self):
+        a, b, c = playlists.append(self.playlist.pk, [s.pk for s in self.songs[:3]])
+        playlists.append(self.playlist.pk, [self.songs[0].pk])
+        playlists.insert(self.playlist.pk, self.songs[4].pk, after_id=a.pk)
+        playlists.insert(self.playlist.pk, self.songs[3].pk)
+        with self.assertNumQueries(7):
+            # SAVEPOINT, khóa playlist (tăng version), hàng xóm, một UPDATE, ảnh bìa, RELEASE
+            playlists.move(c, after_id=None)
+        self.assertEqual(self.titles(), ['S2', 'S3', 'S0', 'S4', 'S1', 'S0'])
+
+    def test_rebalance_when_gap_is_exhausted(self):
+        first, last = playlists.append(self.playlist.pk, [self.songs[0].pk, self.songs[1].pk])
+        for _ in range(20):
+            playlists.insert(self.playlist.pk, self.songs[2].pk, after_id=first.pk)
+        positions = list(self.playlist.entries.values_list('position', flat=True))
+        self.assertEqual(len(set(positions)), 22)
+        self.assertEqual(self.titles()[0], 'S0')
+        self.assertEqual(self.titles()[-1], 'S1')
+
+    def test_replace_keeps_unchanged_entries(self):
+        playlists.append(self.playlist.pk, [s.pk for s in self.songs[:4]])
+        kept = dict(self.playlist.entries.values_list('song__title', 'id'))
+        added, removed = playlists.replace(self.playlist.pk, [self.songs[i].pk for i in (0, 4, 2, 3, 4)])
+        self.assertEqual((added, removed), (2, 1))
+        self.assertEqual(self.titles(), ['S0', 'S4', 'S2', 'S3', 'S4'])
+        ids = dict(self.playlist.entries.filter(song__title__in=['S0', 'S2', 'S3']).values_list('song__title', 'id'))
+        self.assertEqual(ids, {t: kept[t] for t in ('S0', 'S2', 'S3')})
+
+    def test_songs_add_appends_in_order(self):
+        playlists.append(self.playlist.pk, [self.songs[3].pk])
+        self.playlist.songs.add(self.songs[1], self.songs[2])
+        self.assertNotIn(None, self.playlist.entries.values_list('position', flat=True))
+        self.assertEqual(self.titles()[0], 'S3')
+
+    def test_entries_endpoint(self):
+        playlists.append(self.playlist.pk, [s.pk for s in self.songs])
+        url = f'/api/playlists/{self.playlist.pk}/entries/'
+        page = self.client.get(url, {'page_size': 2}).data
+        self.assertEqual([e['song']['title'] for e in page['results']], ['S0', 'S1'])
+        second = self.client.get(page['next']).data
+        self.assertEqual([e['song']['title'] for e in second['results']], ['S2', 'S3'])
+        first_id = page['results'][0]['id']
+        response = self.client.post(url, {'song_id': self.songs[4].pk, 'after': first_id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.patch(f'{url}{response.data["id"]}/', {'after': None}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.delete(f'{url}{first_id}/').status_code, 204)
+        self.assertEqual(self.titles(), ['S4', 'S1', 'S2', 'S3', 'S4'])
+        detail = self.client.get(f'/api/playlists/{self.playlist.pk}/').data
+        self.assertEqual([s['title'] for s in detail['songs']], ['S4', 'S1', 'S2', 'S3', 'S4'])
+
+    def test_entries_endpoint_rejects_malformed_bodies(self):
+        entry = playlists.append(self.playlist.pk, [self.songs[0].pk])[0]
+        url = f'/api/playlists/{self.playlist.pk}/entries/'
+        for body in ({}, {'song_id': 'x'}, {'song_id': self.songs[1].pk, 'after': 'x'}):
+            self.assertEqual(self.client.post(url, body, format='json').status_code, 400)
+        for body in ({}, {'after': 'x'}):
+            self.assertEqual(self.client.patch(f'{url}{entry.pk}/', body, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'song_id': 999}, format='json').status_code, 404)
+        self.assertEqual(self.titles(), ['S0'])
+
+    def test_bulk_changes_return_delta(self):
+        playlists.append(self.playlist.pk, [self.songs[0].pk, self.songs[1].pk, self.songs[0].pk])
+        url = f'/api/playlists/{self.playlist.pk}/songs/bulk/'
+        with self.assertNumQueries(16):
+            response = self.client.post(url, {'add': [self.songs[2].pk, self.songs[3].pk], 'remove': [self.songs[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['song'] for e in response.data['added']], [self.songs[2].pk, self.songs[3].pk])
+        self.assertEqual(len(response.data['removed']), 2)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['version'], Playlist.objects.get(pk=self.playlist.pk).version)
+        self.assertEqual(self.titles(), ['S1', 'S2', 'S3'])
+        response = self.client.post(url, {'add': [self.songs[4].pk, 999]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.titles(), ['S1', 'S2', 'S3'])
+
+    def test_etag_and_if_none_match(self):
+        playlists.append(self.playlist.pk, [self.songs[0].pk])
+        url = f'/api/playlists/{self.playlist.pk}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        list_etag = self.client.get('/api/playlists/')['ETag']
+        self.assertEqual(self.client.get('/api/playlists/', HTTP_IF_NONE_MATCH=list_etag).status_code, 304)
+        # Sửa thông tin bài hát cũng đổi version của playlist chứa nó
+        Song.objects.get(pk=self.songs[0].pk).save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/playlists/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_etag_changes_with_artists_and_stream(self):
+        artist = Artist.objects.create(name='Old name')
+        self.songs[0].artists.add(artist)
+        playlists.append(self.playlist.pk, [self.songs[0].pk])
+        url = f'/api/playlists/{self.playlist.pk}/'
+        etag = self.client.get(url)['ETag']
+        artist.name = 'New name'
+        artist.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['songs'][0]['artists'][0]['name'], 'New name')
+        etag = response['ETag']
+        self.songs[0].artists.add(Artist.objects.create(name='Guest'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        artist.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # Song không có file audio: ingest xóa manifest bằng .update()
+        Song.objects.filter(pk=self.songs[0].pk).update(hls_manifest='songs/hls/old.m3u8')
+        hls.ingest(self.songs[0].pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_match_rejects_stale_writes(self):
+        url = f'/api/playlists/{self.playlist.pk}/'
+        etag = self.client.get(url)['ETag']
+        first = self.client.put(url, {'name': 'A'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(first.status_code, 200)
+        self.assertNotEqual(first['ETag'], etag)
+        stale = self.client.put(url, {'name': 'B'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(stale.status_code, 412)
+        bulk = self.client.post(f'{url}songs/bulk/', {'add': [self.songs[0].pk]}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(bulk.status_code, 412)
+        self.assertEqual(Playlist.objects.get(pk=self.playlist.pk).name, 'A')
+        response = self.client.post(f'{url}songs/bulk/', {'add': [self.songs[0].pk]}, format='json', HTTP_IF_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{self.playlist.pk}-{response.data["version"]}"')
+
+    def assertAggregates(self, count, minutes, covers):
+        playlist = Playlist.objects.get(pk=self.playlist.pk)
+        self.assertEqual((playlist.song_count, playlist.total_duration, playlist.covers), (count, timedelta(minutes=minutes), covers))
+
+    def test_aggregates_follow_every_write(self):
+        album = Album.objects.create(title='A', artist=Artist.objects.create(name='Agg'), image='album_covers/a.jpg')
+        Song.objects.filter(pk=self.songs[1].pk).update(album=album)
+        Song.objects.filter(pk=self.songs[2].pk).update(image='songs/s2.jpg')
+        a, b, c = playlists.append(self.playlist.pk, [s.pk for s in self.songs[:3]])
+        self.assertAggregates(3, 9, ['album_covers/a.jpg', 'songs/s2.jpg'])
+        playlists.move(c, after_id=None)
+        self.assertAggregates(3, 9, ['songs/s2.jpg', 'album_covers/a.jpg'])
+        playlists.remove(self.playlist.pk, [b.pk])
+        self.assertAggregates(2, 6, ['songs/s2.jpg'])
+        playlists.replace(self.playlist.pk, [self.songs[3].pk] * 3)
+        self.assertAggregates(3, 9, [])
+        self.playlist.songs.add(self.songs[1])
+        self.assertAggregates(4, 12, ['album_covers/a.jpg'])
+        self.playlist.songs.remove(self.songs[3])
+        self.assertAggregates(1, 3, ['album_covers/a.jpg'])
+        song = Song.objects.get(pk=self.songs[1].pk)
+        song.duration = timedelta(minutes=5)
+        song.save()
+        self.assertAggregates(1, 5, ['album_covers/a.jpg'])
+        album.image = 'album_covers/b.jpg'
+        album.save()
+        self.assertAggregates(1, 5, ['album_covers/b.jpg'])
+        song.delete()
+        self.assertAggregates(0, 0, [])
+
+    def test_song_edit_applies_delta(self):
+        playlists.append(self.playlist.pk, [self.songs[0].pk, self.songs[1].pk, self.songs[0].pk])
+        version = Playlist.objects.get(pk=self.playlist.pk).version
+        song = Song.objects.get(pk=self.songs[0].pk)
+        song.title = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            song.save()
+        # Không đổi thời lượng/ảnh bìa: chỉ tăng version, không đếm lại
+        self.assertFalse([q for q in queries if 'SUM(' in q['sql'] or 'song__album__image' in q['sql']])
+        self.assertAggregates(3, 9, [])
+        self.assertEqual(Playlist.objects.get(pk=self.playlist.pk).version, version + 1)
+        song.duration = timedelta(minutes=4)
+        song.save()
+        # Bài xuất hiện hai lần: thêm 2 phút
+        self.assertAggregates(3, 11, [])
+
+    def test_rename_keeps_concurrent_aggregates(self):
+        url = f'/api/playlists/{self.playlist.pk}/'
+        get_object = PlaylistDetailAPI.get_object
+
+        def get_object_then_append(view, pk):
+            playlist = get_object(view, pk)
+            # Một request khác thêm bài sau khi playlist đã được đọc
+            playlists.append(self.playlist.pk, [self.songs[0].pk, self.songs[1].pk])
+            return playlist
+
+        with mock.patch.object(PlaylistDetailAPI, 'get_object', get_object_then_append):
+            response = self.client.put(url, {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        playlist = Playlist.objects.get(pk=self.playlist.pk)
+        self.assertEqual(playlist.name, 'Renamed')
+        self.assertEqual((playlist.song_count, playlist.total_duration), (2, timedelta(minutes=6)))
+
+    def test_list_returns_summaries(self):
+        playlists.append(self.playlist.pk, [s.pk for s in self.songs[:2]])
+        Playlist.objects.create(name='Empty', user=self.user)
+        with self.assertNumQueries(2):
+            # ETag (id, version) và một query cho các trường tổng hợp
+            data = self.client.get('/api/playlists/').data
+        self.assertEqual([(p['name'], p['song_count'], p['total_duration']) for p in data], [('Mix', 2, '00:06:00'), ('Empty', 0, '00:00:00')])
+        self.assertNotIn('songs', data[0])
+        expanded = self.client.get('/api/playlists/', {'expand': 'songs'}).data
+        self.assertEqual([s['title'] for s in expanded[0]['songs']], ['S0', 'S1'])
+        self.assertEqual(expanded[0]['song_count'], 2)
+
+
+class AlbumSongsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        artist = Artist.objects.create(name='Artist')
+        self.album = Album.objects.create(title='Album', artist=artist, image='album_covers/a.jpg')
+        self.other = Album.objects.create(title='Other', artist=artist)
+        self.songs = [Song.objects.create(title=f'S{i}', duration=timedelta(minutes=3)) for i in range(6)]
+        self.url = f'/api/albums/{self.album.id}/add_songs/'
+
+    def album_songs(self):
+        return set(Song.objects.filter(album=self.album).values_list('title', flat=True))
+
+    def put(self, indexes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(self.url, {'song_ids': [self.songs[i].pk for i in indexes]}, format='json')
+
+    def count_queries(self, indexes):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.put(indexes).status_code, 200)
+        return len(queries)
+
+    def test_reassignment_returns_summary(self):
+        self.assertEqual(self.put([0, 1, 2]).data, {'album': self.album.id, 'song_count': 3, 'added': 3, 'removed': 0})
+        response = self.put([1, 2, 3, 4])
+        self.assertEqual(response.data, {'album': self.album.id, 'song_count': 4, 'added': 2, 'removed': 1})
+        self.assertEqual(self.album_songs(), {'S1', 'S2', 'S3', 'S4'})
+        self.assertIsNone(Song.objects.get(pk=self.songs[0].pk).album_id)
+        self.assertIn('album', Song.objects.get(pk=self.songs[3].pk).search_document)
+        response = self.put([4, 3, 2, 1])
+        self.assertEqual((response.data['added'], response.data['removed']), (0, 0))
+        self.assertIn('message', response.data)
+
+    def test_invalid_ids_change_nothing(self):
+        self.put([0, 1])
+        Song.objects.filter(pk=self.songs[5].pk).update(album=self.other)
+        # Bài thuộc album khác, rồi id không tồn tại
+        self.assertEqual(self.put([2, 5]).status_code, 400)
+        self.assertEqual(self.client.put(self.url, {'song_ids': [self.songs[2].pk, 999]}, format='json').status_code, 400)
+        self.assertEqual(self.album_songs(), {'S0', 'S1'})
+        self.assertEqual(self.client.put(self.url, {'song_ids': 'x'}, format='json').status_code, 400)
+
+    def test_query_count_does_not_grow_with_album_size(self):
+        self.songs += [Song.objects.create(title=f'S{i}', duration=timedelta(minutes=3)) for i in range(6, 16)]
+        self.put([0])
+        # Một bài ra, một bài vào
+        small = self.count_queries([1])
+        self.put(range(6, 11))
+        # Năm bài ra, năm bài vào
+        large = self.count_queries(range(11, 16))
+        self.assertEqual(small, large)
+        self.assertEqual(self.album_songs(), {f'S{i}' for i in range(11, 16)})
+
+    def test_playlist_covers_follow_album_changes(self):
+        playlist = Playlist.objects.create(name='Mix', user=User.objects.create_user('p', password='x'))
+        playlists.append(playlist.pk, [self.songs[0].pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.put([0])
+        # Chỉ ảnh bìa được tính lại, không đếm lại số bài/thời lượng
+        self.assertFalse([q for q in queries if 'SUM(' in q['sql']])
+        self.assertEqual(Playlist.objects.get(pk=playlist.pk).covers, ['album_covers/a.jpg'])
+        self.assertEqual(Playlist.objects.get(pk=playlist.pk).song_count, 1)
+        self.put([1])
+        self.assertEqual(Playlist.objects.get(pk=playlist.pk).covers, [])
@@ -0,0 +1,65 @@
+"""Resized cover-art derivatives for Album.image and Song.image.
+
+Derivatives are generated on first request and stored under
+``MEDIA_ROOT/derived/`` with a name derived from the source file's name,
+size and modification time plus the requested size and format, so a
+replaced image never reuses a stale derivative.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+DERIVED_DIR = 'derived'
+
+SIZES = {
+    'small': 64,
+    'medium': 300,
+    'large': 640,
+}
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def derivative_name(field_file, size, ext):
+    storage = field_file.storage
+    stamp = storage.get_modified_time(field_file.name).timestamp()
+    source = f'{field_file.name}:{storage.size(field_file.name)}:{stamp}:{size}:{ext}'
+    key = hashlib.sha1(source.encode()).hexdigest()
+    return f'{DERIVED_DIR}/{key[:2]}/{key}.{ext}'
+
+
+def _render(source, target, size, ext):
+    pil_format, options = FORMATS[ext]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((SIZES[size], SIZES[size]), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên để request song song không đọc file dở dang
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, pil_format, **options)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def get_derivative(field_file, size, ext):
+    """Return the storage name of the derivative, generating it if needed."""
+    name = derivative_name(field_file, size, ext)
+    target = os.path.join(settings.MEDIA_ROOT, *name.split('/'))
+    if not os.path.exists(target):
+        with field_file.storage.open(field_file.name, 'rb') as source:
+            _render(source, target, size, ext)
+    return name
@@ -13,11 +13,17 @@ urlpatterns = [
 
     path('songs/', views.SongList.as_view(), name='song-list'),
     path('songs/<int:pk>/', views.SongDetail.as_view(), name='song'),
+    path('songs/<int:pk>/stream/<str:kind>/', views.SongStreamView.as_view(), name='song-stream'),
     path('search/', views.SongSearchAPI.as_view(), name='search'),
+    path('images/<str:kind>/<int:pk>/<str:size>.<str:ext>', views.ImageDerivativeView.as_view(), name='image-derivative'),
+    path('search/autocomplete/', views.AutocompleteAPI.as_view(), name='search-autocomplete'),
 
     path('playlists/', views.PlaylistAPI.as_view(), name='playlist-list-create'),
     path('playlists/<int:pk>/', views.PlaylistDetailAPI.as_view(), name='playlist-detail'),
     path('playlists/<int:pk>/songs/', views.PlaylistSongAPI.as_view(), name='playlist-song'),
+    path('playlists/<int:pk>/songs/bulk/', views.PlaylistSongsBulkAPI.as_view(), name='playlist-songs-bulk'),
+    path('playlists/<int:pk>/entries/', views.PlaylistEntriesAPI.as_view(), name='playlist-entries'),
+    path('playlists/<int:pk>/entries/<int:entry_pk>/', views.PlaylistEntryDetailAPI.as_view(), name='playlist-entry-detail'),
 
     path('auth/login/', views.LoginAPI.as_view(), name='login'),
     path('auth/logout/', views.LogoutAPI.as_view(), name='logout'),
@@ -28,6 +34,7 @@ urlpatterns = [
     path('users/', views.UserListAPI.as_view(), name='user-list'),
 
     path('recent-chats/', views.RecentChatsAPI.as_view(), name='recent-chats'),
+    path('admin/chat-metrics/', views.ChatMetricsAPI.as_view(), name='chat-metrics'),
     
     path('messages/<str:receiver_username>/', views.MessageHistoryAPI.as_view(), name='message-history'),
 ]
\ No newline at end of file
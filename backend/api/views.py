@@ -1,17 +1,96 @@
 from rest_framework import generics, status, permissions
-from django.db.models import Q
+from rest_framework.exceptions import APIException
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils.http import parse_etags, quote_etag
+import hashlib
+from django.views import View
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Artist, Album, Song, Playlist, Message
-from .serializers import ArtistSerializer, AlbumSerializer, SongSerializer, PlaylistSerializer, UserSerializer
+from .models import Artist, Album, Song, Playlist, PlaylistEntry, Message, ConversationSummary, conversation_key
+from .serializers import ArtistSerializer, AlbumSerializer, SongSerializer, PlaylistSerializer, PlaylistSummarySerializer, UserSerializer, UserSummarySerializer, RecentChatSerializer, PlaylistEntrySerializer, PlaylistChangesSerializer, PlaylistEntryCreateSerializer, PlaylistEntryMoveSerializer, AlbumSongsSerializer
 from django.contrib.auth import authenticate, logout
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.models import User
 from .serializers import MessageSerializer
+from .pagination import OptionalCursorPagination, PlaylistEntryPagination, message_window
+from . import search, autocomplete, playlists, albums
+from .response_cache import CachedResponseMixin
+from .streaming import serve_file
+from .metrics import metrics
+from . import thumbnails
+from django.core.files.storage import default_storage
+from PIL import UnidentifiedImageError
+
+def song_queryset():
+    # Nạp sẵn album (kèm artist) và artists để SongSerializer không query theo từng dòng
+    return Song.objects.select_related('album__artist').prefetch_related('artists')
+
+def playlist_entry_queryset():
+    return PlaylistEntry.objects.select_related('song__album__artist').prefetch_related('song__artists').order_by('position', 'id')
+
+def playlist_queryset():
+    return Playlist.objects.prefetch_related(Prefetch('entries', queryset=playlist_entry_queryset()))
+
+def playlist_etag(playlist_id, version):
+    return quote_etag(f'{playlist_id}-{version}')
+
+def etag_matches(header, etag, weak=True):
+    # If-None-Match so sánh yếu (bỏ W/), If-Match so sánh mạnh
+    if not header:
+        return False
+    tags = parse_etags(header)
+    if weak:
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    return '*' in tags or etag in tags
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Playlist has been modified.'
+    default_code = 'precondition_failed'
+
+class PlaylistConcurrencyMixin:
+    """Optimistic concurrency for views of one playlist (``pk`` in the URL).
+
+    Writes run in a transaction; with ``If-Match`` the playlist row is
+    locked and the request is rejected with 412 unless the tag matches the
+    current version. Successful writes return the new ``ETag``.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in permissions.SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with transaction.atomic():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if_match = request.headers.get('If-Match')
+        if if_match and request.method not in permissions.SAFE_METHODS:
+            version = Playlist.objects.select_for_update().filter(pk=kwargs['pk'], user=request.user).values_list('version', flat=True).first()
+            if version is not None and not etag_matches(if_match, playlist_etag(kwargs['pk'], version), weak=False):
+                raise PreconditionFailed()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in permissions.SAFE_METHODS and 200 <= response.status_code < 300:
+            version = Playlist.objects.filter(pk=kwargs['pk']).values_list('version', flat=True).first()
+            if version is not None:
+                response['ETag'] = playlist_etag(kwargs['pk'], version)
+        return response
+
+def serialize_users(request, users):
+    # Mặc định chỉ trả về thông tin rút gọn; ?expand=playlists để kèm playlist
+    expand = request.query_params.get('expand', '').split(',')
+    if 'playlists' in expand:
+        users = users.prefetch_related(Prefetch('playlist_set', queryset=playlist_queryset()))
+        return UserSerializer(users, many=True).data
+    return UserSummarySerializer(users, many=True).data
 
 # Danh sach va tao moi Artist
-class ArtistList(generics.ListCreateAPIView):
+class ArtistList(CachedResponseMixin, generics.ListCreateAPIView):
+    cache_models = ('artist',)
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
 
@@ -20,86 +99,93 @@ class ArtistDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ArtistSerializer
 
 # Danh sach va tao moi Album
-class AlbumList(generics.ListCreateAPIView):
+class AlbumList(CachedResponseMixin, generics.ListCreateAPIView):
+    cache_models = ('album',)
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
 
-class AlbumDetail(generics.RetrieveUpdateDestroyAPIView):
+class AlbumDetail(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
+    cache_models = ('album',)
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
 
-class AlbumSongsView(generics.ListAPIView):
+class AlbumSongsView(CachedResponseMixin, generics.ListAPIView):
+    cache_models = ('song', 'album', 'artist')
     serializer_class = SongSerializer
 
     def get_queryset(self):
         album_id = self.kwargs['album_id']
-        return Song.objects.filter(album__id=album_id)
+        return song_queryset().filter(album__id=album_id)
     
 class AddSongToAlbumView(generics.UpdateAPIView):
     queryset = Album.objects.all()
-    serializer_class = AlbumSerializer
+    serializer_class = AlbumSongsSerializer
     lookup_url_kwarg = 'album_id'
 
     def update(self, request, *args, **kwargs):
-        album = self.get_object()  # Retrieves Album instance based on album_id
-        new_song_ids = request.data.get('song_ids', [])
-
-        # Get current song IDs assigned to the album
-        current_songs = Song.objects.filter(album=album)
-        current_song_ids = list(current_songs.values_list('id', flat=True))
-
-        # Convert new_song_ids to a set for comparison (to ignore order)
-        new_song_ids_set = set(new_song_ids)
-        current_song_ids_set = set(current_song_ids)
-
-        # Case 1: New song IDs are identical to current song IDs
-        if new_song_ids_set == current_song_ids_set:
-            return Response(
-                {"message": "Bài hát đã được cập nhật (danh sách không thay đổi)"},
-                status=status.HTTP_200_OK
-            )
-
-        # Case 2: New song IDs differ from current song IDs
+        # Thay toàn bộ danh sách bài hát trong một transaction (api.albums);
+        # chỉ trả về số bài thêm/bớt thay vì serialize lại album
+        album = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         try:
-            # Validate new song IDs (ensure they exist and are unassigned or assigned to this album)
-            songs_to_assign = Song.objects.filter(
-                Q(id__in=new_song_ids) & (Q(album__isnull=True) | Q(album=album))
-            )
-            if len(songs_to_assign) != len(new_song_ids_set):
-                return Response(
-                    {"error": "One or more song IDs are invalid or already assigned to another album"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Remove album assignment from songs that are in current_song_ids but not in new_song_ids
-            songs_to_remove = Song.objects.filter(
-                album=album, 
-                id__in=(current_song_ids_set - new_song_ids_set)
-            )
-            songs_to_remove.update(album=None)
-
-            # Assign the album to the new songs
-            songs_to_assign.update(album=album)
-
-            # Serialize and return the updated album
-            serializer = self.get_serializer(album)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
-        except Exception as e:
+            summary = albums.set_songs(album.pk, serializer.validated_data['song_ids'])
+        except albums.SongsUnavailable:
             return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "One or more song IDs are invalid or already assigned to another album"},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        if not summary['added'] and not summary['removed']:
+            summary['message'] = "Bài hát đã được cập nhật (danh sách không thay đổi)"
+        return Response(summary, status=status.HTTP_200_OK)
     
 # Danh sach va tao moi Song
-class SongList(generics.ListCreateAPIView):
-    queryset = Song.objects.all()
+class SongList(CachedResponseMixin, generics.ListCreateAPIView):
+    cache_models = ('song', 'album', 'artist')
+    queryset = song_queryset()
     serializer_class = SongSerializer
 
-class SongDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Song.objects.all()
+class SongDetail(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
+    cache_models = ('song', 'album', 'artist')
+    queryset = song_queryset()
     serializer_class = SongSerializer
 
+class SongStreamView(View):
+    # Phát audio/video hỗ trợ Range (tua nhạc) và ETag, thay cho static MEDIA_URL
+    fields = {'audio': 'audio_file', 'video': 'video_file'}
+
+    def get(self, request, pk, kind):
+        if kind not in self.fields:
+            raise Http404
+        try:
+            song = Song.objects.only(self.fields[kind]).get(pk=pk)
+        except Song.DoesNotExist:
+            raise Http404
+        field_file = getattr(song, self.fields[kind])
+        if not field_file or not field_file.storage.exists(field_file.name):
+            raise Http404
+        return serve_file(request, field_file.storage, field_file.name)
+
+class ImageDerivativeView(View):
+    # Ảnh bìa thu nhỏ, tạo khi được yêu cầu lần đầu và lưu lại trên đĩa
+    models = {'album': Album, 'song': Song}
+
+    def get(self, request, kind, pk, size, ext):
+        if kind not in self.models or size not in thumbnails.SIZES or ext not in thumbnails.FORMATS:
+            raise Http404
+        try:
+            obj = self.models[kind].objects.only('image').get(pk=pk)
+        except self.models[kind].DoesNotExist:
+            raise Http404
+        if not obj.image or not obj.image.storage.exists(obj.image.name):
+            raise Http404
+        try:
+            name = thumbnails.get_derivative(obj.image, size, ext)
+        except (UnidentifiedImageError, OSError):
+            raise Http404
+        return serve_file(request, default_storage, name)
+
 class SongSearchAPI(APIView):
     def get(self, request):
         query = request.GET.get('q', '').strip()
@@ -107,23 +193,51 @@ class SongSearchAPI(APIView):
         if not query:
             return Response([])
             
-        songs = Song.objects.filter(
-            Q(title__icontains=query) |
-            Q(artists__name__icontains=query) |
-            Q(album__title__icontains=query)    |
-            Q(duration__icontains=query)
-        ).distinct()[:20]  # Giới hạn 20 kết quả
+        song_ids = search.search_songs(query, limit=20)  # Giới hạn 20 kết quả
+        songs = song_queryset().in_bulk(song_ids)
+        songs = [songs[song_id] for song_id in song_ids if song_id in songs]
         
         serializer = SongSerializer(songs, many=True)
         return Response(serializer.data)
 
+class AutocompleteAPI(APIView):
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return Response([])
+        try:
+            limit = min(int(request.GET.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        return Response(autocomplete.complete(query, limit))
+
 # Danh sach va tao moi Playlist
 class PlaylistAPI(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        playlists = Playlist.objects.filter(user=request.user)
-        serializer = PlaylistSerializer(playlists, many=True)
+        # ETag theo (id, version) của mọi playlist: 304 mà không cần serialize
+        versions = list(Playlist.objects.filter(user=request.user).order_by('id').values_list('id', 'version'))
+        etag = quote_etag(hashlib.sha1(repr(versions).encode()).hexdigest()[:20])
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = self.list_response(request)
+        response['ETag'] = etag
+        return response
+
+    def list_response(self, request):
+        # Mặc định chỉ trả các trường tổng hợp (một query trên index user);
+        # ?expand=songs để kèm toàn bộ bài hát như trước
+        if 'songs' in request.query_params.get('expand', '').split(','):
+            playlists, serializer_class = playlist_queryset(), PlaylistSerializer
+        else:
+            playlists, serializer_class = Playlist.objects.all(), PlaylistSummarySerializer
+        playlists = playlists.filter(user=request.user)
+        paginator = OptionalCursorPagination()
+        page = paginator.paginate_queryset(playlists, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(serializer_class(page, many=True).data)
+        serializer = serializer_class(playlists, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request):
@@ -137,14 +251,19 @@ class PlaylistAPI(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class PlaylistDetailAPI(APIView):
+class PlaylistDetailAPI(PlaylistConcurrencyMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
+        version = Playlist.objects.filter(pk=pk, user=request.user).values_list('version', flat=True).first()
+        if version is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if etag_matches(request.headers.get('If-None-Match'), playlist_etag(pk, version)):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': playlist_etag(pk, version)})
         try:
-            playlist = Playlist.objects.get(pk=pk, user=self.request.user)
+            playlist = playlist_queryset().get(pk=pk, user=self.request.user)
             serializer = PlaylistSerializer(playlist)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK, headers={'ETag': playlist_etag(pk, playlist.version)})
         except Playlist.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -161,7 +280,7 @@ class PlaylistDetailAPI(APIView):
         serializer = PlaylistSerializer(playlist, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(PlaylistSerializer(playlist_queryset().get(pk=pk)).data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
@@ -171,7 +290,7 @@ class PlaylistDetailAPI(APIView):
         playlist.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class PlaylistSongAPI(APIView):
+class PlaylistSongAPI(PlaylistConcurrencyMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self, pk):
@@ -187,8 +306,9 @@ class PlaylistSongAPI(APIView):
         song_id = request.data.get('song_id')
         try:
             song = Song.objects.get(id=song_id)
-            playlist.songs.add(song)
-            serializer = PlaylistSerializer(playlist)
+            # Thêm vào cuối; cùng một bài có thể xuất hiện nhiều lần
+            playlists.append(playlist.pk, [song.pk])
+            serializer = PlaylistSerializer(playlist_queryset().get(pk=playlist.pk))
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Song.DoesNotExist:
             return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -200,11 +320,87 @@ class PlaylistSongAPI(APIView):
         try:
             song = Song.objects.get(id=song_id)
             playlist.songs.remove(song)
-            serializer = PlaylistSerializer(playlist)
+            serializer = PlaylistSerializer(playlist_queryset().get(pk=playlist.pk))
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Song.DoesNotExist:
             return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
 
+class PlaylistEntriesAPI(PlaylistConcurrencyMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_playlist_id(self, pk):
+        return Playlist.objects.filter(pk=pk, user=self.request.user).values_list('pk', flat=True).first()
+
+    def get(self, request, pk):
+        playlist_id = self.get_playlist_id(pk)
+        if playlist_id is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        paginator = PlaylistEntryPagination()
+        page = paginator.paginate_queryset(playlist_entry_queryset().filter(playlist_id=playlist_id), request, view=self)
+        return paginator.get_paginated_response(PlaylistEntrySerializer(page, many=True, context={'request': request}).data)
+
+    def post(self, request, pk):
+        # {"song_id": 1, "after": <entry id> | null}; không có "after" thì thêm vào cuối
+        playlist_id = self.get_playlist_id(pk)
+        if playlist_id is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = PlaylistEntryCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        song_id = serializer.validated_data['song_id']
+        if not Song.objects.filter(pk=song_id).exists():
+            return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
+        if 'after' not in serializer.validated_data:
+            entry = playlists.append(playlist_id, [song_id])[0]
+        else:
+            after = serializer.validated_data['after']
+            if after is not None and not PlaylistEntry.objects.filter(pk=after, playlist_id=playlist_id).exists():
+                return Response({'error': 'Entry not found'}, status=status.HTTP_400_BAD_REQUEST)
+            entry = playlists.insert(playlist_id, song_id, after)
+        return Response({'id': entry.pk, 'position': entry.position, 'song': entry.song_id}, status=status.HTTP_201_CREATED)
+
+class PlaylistEntryDetailAPI(PlaylistConcurrencyMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, pk, entry_pk):
+        return PlaylistEntry.objects.filter(pk=entry_pk, playlist_id=pk, playlist__user=self.request.user).first()
+
+    def patch(self, request, pk, entry_pk):
+        # Di chuyển: {"after": <entry id> | null (lên đầu)}
+        entry = self.get_object(pk, entry_pk)
+        if entry is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = PlaylistEntryMoveSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        after = serializer.validated_data['after']
+        if after is not None and not PlaylistEntry.objects.filter(pk=after, playlist_id=entry.playlist_id).exists():
+            return Response({'error': 'Entry not found'}, status=status.HTTP_400_BAD_REQUEST)
+        entry = playlists.move(entry, after)
+        return Response({'id': entry.pk, 'position': entry.position, 'song': entry.song_id}, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk, entry_pk):
+        entry = self.get_object(pk, entry_pk)
+        if entry is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        playlists.remove(entry.playlist_id, [entry.pk])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class PlaylistSongsBulkAPI(PlaylistConcurrencyMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        # {"add": [song ids], "remove": [song ids]}: chỉ trả về phần thay đổi,
+        # nội dung playlist lấy qua /entries/ (có phân trang)
+        playlist_id = Playlist.objects.filter(pk=pk, user=request.user).values_list('pk', flat=True).first()
+        if playlist_id is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = PlaylistChangesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        delta = playlists.apply_changes(playlist_id, serializer.validated_data['add'], serializer.validated_data['remove'])
+        return Response(delta, status=status.HTTP_200_OK)
+
 # Danh sach va tao moi User
 class LoginAPI(APIView):
     def post(self, request):
@@ -255,22 +451,19 @@ class UserListAPI(APIView):
             users = User.objects.filter(username__icontains=search_query, is_staff=False, is_superuser=False)
         else:
             users = User.objects.filter(is_staff=False, is_superuser=False)
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serialize_users(request, users), status=status.HTTP_200_OK)
     
 class RecentChatsAPI(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
         user = request.user
-        # Lấy danh sách user đã chat với user hiện tại
-        sent_messages = Message.objects.filter(sender=user).values('receiver__username').distinct()
-        received_messages = Message.objects.filter(receiver=user).values('sender__username').distinct()
-        usernames = {m['receiver__username'] for m in sent_messages}.union(
-            {m['sender__username'] for m in received_messages}
-        )
-        users = User.objects.filter(username__in=usernames).exclude(username=user.username)
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Đọc bảng ConversationSummary (index user, -last_message_at), mới nhất trước
+        if 'playlists' in request.query_params.get('expand', '').split(','):
+            users = User.objects.filter(peer_summaries__user=user).exclude(id=user.id).order_by('-peer_summaries__last_message_at')
+            return Response(serialize_users(request, users), status=status.HTTP_200_OK)
+        summaries = (ConversationSummary.objects.filter(user=user).exclude(peer=user)
+                     .select_related('peer', 'last_sender').order_by('-last_message_at'))
+        return Response(RecentChatSerializer(summaries, many=True).data, status=status.HTTP_200_OK)
     
 class RegisterAPI(APIView):
     def post(self, request):
@@ -337,6 +530,12 @@ class AdminAPI(APIView):
 
     def get(self, request):
         return Response({'message': 'Chào mừng đến với Admin API'}, status=status.HTTP_200_OK)
+
+class ChatMetricsAPI(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
     
 class MessageHistoryAPI(APIView):
     permission_classes = [IsAuthenticated]
@@ -345,10 +544,20 @@ class MessageHistoryAPI(APIView):
         user = request.user
         try:
             receiver = User.objects.get(username=receiver_username)
+            # Dùng index (conversation_id, timestamp, id) thay cho OR hai điều kiện sender/receiver
             messages = Message.objects.filter(
-                Q(sender=user, receiver=receiver) | 
-                Q(sender=receiver, receiver=user)
-            ).order_by('timestamp')
+                conversation_id=conversation_key(user.id, receiver.id)
+            ).select_related('sender', 'receiver').order_by('timestamp', 'id')
+            if 'unread' in request.query_params:
+                # Chỉ lấy tin sau watermark đã đọc (ConversationSummary.last_read_at)
+                last_read_at = ConversationSummary.objects.filter(user=user, peer=receiver).values_list('last_read_at', flat=True).first()
+                if last_read_at is not None:
+                    messages = messages.filter(timestamp__gt=last_read_at)
+                return Response(message_window(messages, request.query_params, MessageSerializer, oldest_first=True), status=status.HTTP_200_OK)
+            # Phân trang duy nhất là cửa sổ before/after/limit (message_window);
+            # không có tham số nào thì trả toàn bộ lịch sử như client cũ mong đợi
+            if {'before', 'after', 'limit'} & set(request.query_params):
+                return Response(message_window(messages, request.query_params, MessageSerializer), status=status.HTTP_200_OK)
             serializer = MessageSerializer(messages, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except User.DoesNotExist:
@@ -0,0 +1,169 @@
+"""Wire formats of the chat websocket.
+
+The client picks a format with a ``Sec-WebSocket-Protocol`` entry
+(``chat.<format>``) or ``?format=<format>``; without either the verbose
+JSON protocol is used. Formats:
+
+``json``
+    One JSON object per frame with usernames and ISO timestamps.
+``compact``
+    JSON with one-letter keys, numeric user ids and epoch-millisecond
+    timestamps (``{"t": "m", "c": ..., "s": 1, "r": 2, "ts": ...}``).
+``msgpack``
+    The compact frames encoded with MessagePack, sent as binary.
+
+Appending ``.deflate`` (e.g. ``chat.msgpack.deflate``) compresses every
+outgoing frame with a deflate context kept for the whole connection, the
+same way permessage-deflate does (RFC 7692: raw deflate, sync flush,
+trailing ``00 00 ff ff`` removed); daphne does not negotiate the
+extension itself. Compressed frames are always binary. Client frames use
+the same serialization, uncompressed.
+"""
+import json
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from .chat_auth import query_param
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack đi kèm channels_redis
+    msgpack = None
+
+SUBPROTOCOL_PREFIX = 'chat.'
+DEFLATE_SUFFIX = '.deflate'
+
+
+def epoch_ms(value):
+    return int(value.timestamp() * 1000)
+
+
+def from_epoch_ms(value):
+    return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+
+
+class Deflater:
+    def __init__(self):
+        self._compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+    def __call__(self, data):
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data[:-4]
+
+
+class JSONCodec:
+    binary = False
+
+    def __init__(self, deflate=False):
+        self.deflate = Deflater() if deflate else None
+
+    # Frame gửi xuống client, dựng từ event của channel layer
+    def message(self, event):
+        return {
+            'content': event['content'],
+            'sender': event['sender'],
+            'timestamp': event['timestamp'],
+            'receiver': event['receiver'],
+        }
+
+    def read(self, event, own):
+        frame = {'type': 'read', 'reader': event['reader'], 'peer': event['peer'], 'read_at': event['read_at']}
+        if own:
+            frame['unread_count'] = event['unread_count']
+        return frame
+
+    def presence(self, event):
+        return {'type': 'presence', 'user': event['user'], 'online': event['online']}
+
+    def presence_list(self, peers):
+        return {'type': 'presence', 'online': [username for _, username in peers]}
+
+    def error(self, text):
+        return {'error': text}
+
+    def serialize(self, payload):
+        return json.dumps(payload)
+
+    def encode(self, payload):
+        """Return the ``send()`` keyword arguments for a frame or list of frames."""
+        data = self.serialize(payload)
+        if self.deflate is not None:
+            if isinstance(data, str):
+                data = data.encode('utf8')
+            return {'bytes_data': self.deflate(data)}
+        if self.binary:
+            return {'bytes_data': data}
+        return {'text_data': data}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class CompactCodec(JSONCodec):
+    def message(self, event):
+        return {
+            't': 'm',
+            'c': event['content'],
+            's': event['sender_id'],
+            'r': event['receiver_id'],
+            'ts': event['timestamp_ms'],
+        }
+
+    def read(self, event, own):
+        frame = {'t': 'r', 'u': event['reader_id'], 'p': event['peer_id'], 'ts': event['read_at_ms']}
+        if own:
+            frame['n'] = event['unread_count']
+        return frame
+
+    def presence(self, event):
+        return {'t': 'p', 'u': event['user_id'], 'o': int(event['online'])}
+
+    def presence_list(self, peers):
+        return {'t': 'P', 'u': [peer_id for peer_id, _ in peers]}
+
+    def error(self, text):
+        return {'t': 'e', 'e': text}
+
+    def serialize(self, payload):
+        return json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
+
+class MsgPackCodec(CompactCodec):
+    binary = True
+
+    def serialize(self, payload):
+        return msgpack.packb(payload)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return super().decode(text_data)
+        return msgpack.unpackb(bytes_data)
+
+
+CODECS = {'json': JSONCodec, 'compact': CompactCodec}
+if msgpack is not None:
+    CODECS['msgpack'] = MsgPackCodec
+
+
+def _codec(name):
+    deflate = name.endswith(DEFLATE_SUFFIX)
+    if deflate:
+        name = name[:-len(DEFLATE_SUFFIX)]
+    codec_class = CODECS.get(name)
+    return codec_class(deflate=deflate) if codec_class is not None else None
+
+
+def negotiate(scope):
+    """Return ``(codec, subprotocol)`` for a websocket scope.
+
+    The first subprotocol offered by the client that names a known format
+    wins; ``subprotocol`` is what ``accept()`` must echo back (``None`` when
+    the format came from the query string or the default).
+    """
+    for subprotocol in scope.get('subprotocols', []):
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            codec = _codec(subprotocol[len(SUBPROTOCOL_PREFIX):])
+            if codec is not None:
+                return codec, subprotocol
+    codec = _codec(query_param(scope, 'format') or 'json')
+    return codec or JSONCodec(), None
@@ -2,7 +2,7 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from api.chat_auth import JWTAuthMiddleware
 import api.routing
 
 # Đặt DJANGO_SETTINGS_MODULE nếu chưa có
@@ -10,7 +10,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = ProtocolTypeRouter({
     'http': get_asgi_application(),
-    'websocket': AuthMiddlewareStack(
+    'websocket': JWTAuthMiddleware(
         URLRouter(api.routing.websocket_urlpatterns)
     ),
 })
\ No newline at end of file
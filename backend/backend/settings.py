@@ -47,9 +47,60 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'backend.asgi.application'
 
+# Ghi tin nhắn chat theo lô (api.chat_writer)
+CHAT_WRITE_BATCH_SIZE = 100
+CHAT_WRITE_FLUSH_INTERVAL = 0.05  # giây
+CHAT_WRITE_MAX_ATTEMPTS = 3
+CHAT_USER_CACHE_SIZE = 10000
+
+# Hàng đợi gửi của mỗi kết nối websocket (api.send_queue)
+CHAT_SEND_QUEUE_SIZE = 256
+CHAT_SEND_BATCH_MAX = 50  # số frame tối đa gộp trong một lần gửi (?batch=1)
+CHAT_SEND_OVERFLOW = 'drop_oldest'  # hoặc 'disconnect'
+
+# Log có cấu trúc cho chat (api.chat_logging); tỉ lệ lấy mẫu theo từng sự kiện
+CHAT_LOG_SAMPLE_RATES = {
+    'chat.message_received': 0.01,
+    'chat.message_delivered': 0.01,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.chat_logging.JSONFormatter'},
+    },
+    'handlers': {
+        'chat': {
+            'class': 'api.chat_logging.QueueStreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'api.chat': {
+            'handlers': ['chat'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Cache xác thực JWT cho websocket (api.chat_auth)
+CHAT_AUTH_CACHE_TTL = 30  # giây
+CHAT_AUTH_CACHE_SIZE = 10000
+
+# Trạng thái online của user chat (api.presence)
+CHAT_PRESENCE_STORE = 'api.presence.RedisPresenceStore'
+CHAT_PRESENCE_STORE_OPTIONS = {'url': 'redis://127.0.0.1:6379/1'}
+CHAT_PRESENCE_TTL = 60  # giây không có heartbeat thì coi như offline
+CHAT_PRESENCE_HEARTBEAT = 20  # giây
+CHAT_PRESENCE_PEERS = 100  # số cuộc trò chuyện gần nhất được báo thay đổi
+CHAT_PRESENCE_PEERS_TTL = 30  # giây
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        # RedisChannelLayer có thêm group_send_many (gửi nhiều group trong một lần)
+        'BACKEND': 'api.channel_layers.MultiGroupRedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
         },
@@ -70,7 +121,9 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.OptionalCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 CORS_ALLOWED_ORIGINS = [
@@ -90,6 +143,24 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
+# Cache mặc định trong bộ nhớ; dùng django.core.cache.backends.redis.RedisCache
+# (hoặc Memcached) khi chạy nhiều worker để việc xóa cache có hiệu lực ở mọi process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'spotify-clone',
+    },
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+
+# Đóng gói HLS cho bài hát (api.hls); ByteSplitSegmenter không cần ffmpeg
+HLS_SEGMENTER = 'api.hls.FFmpegSegmenter'
+HLS_SEGMENT_SECONDS = 6
+HLS_BITRATES = ['64k', '128k', '192k']
+HLS_INGEST_ASYNC = True
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
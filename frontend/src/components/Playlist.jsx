@@ -17,6 +17,7 @@ const Playlist = () => {
   const [selectedSongId, setSelectedSongId] = useState(null);
   const [playlists, setPlaylists] = useState([]);
   const [availableSongs, setAvailableSongs] = useState([]);
+  const [playlistSongIds, setPlaylistSongIds] = useState([]);
   const [searchQuery, setSearchQuery] = useState('');
   const [loading, setLoading] = useState(true);
 
@@ -130,11 +131,28 @@ const Playlist = () => {
     }
   };
 
-  const getAvailableSongsForPlaylist = (playlistId) => {
-    const currentPlaylist = playlists.find((p) => p.id === playlistId);
-    if (!currentPlaylist || !currentPlaylist.songs) return availableSongs;
-    const currentSongIds = currentPlaylist.songs.map((song) => song.id);
-    let filteredSongs = availableSongs.filter((song) => !currentSongIds.includes(song.id));
+  // The playlist list only carries summaries: load the playlist's songs
+  // when the add-song dialog opens so the picker can hide them
+  const openSongModal = async (playlistId) => {
+    setEditPlaylistId(playlistId);
+    setPlaylistSongIds([]);
+    setIsSongModalOpen(true);
+    const token = localStorage.getItem('access_token');
+    try {
+      const response = await fetch(`${url}/api/playlists/${playlistId}/`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
+      if (response.ok) {
+        const playlist = await response.json();
+        setPlaylistSongIds(playlist.songs.map((song) => song.id));
+      }
+    } catch (error) {
+      console.error('Error fetching playlist songs:', error);
+    }
+  };
+
+  const getAvailableSongsForPlaylist = () => {
+    let filteredSongs = availableSongs.filter((song) => !playlistSongIds.includes(song.id));
     if (searchQuery) {
       filteredSongs = filteredSongs.filter(
         (song) =>
@@ -146,11 +164,36 @@ const Playlist = () => {
   };
 
   const getPlaylistImage = (playlist) => {
-    return playlist.songs.length > 0 && playlist.songs[0].image
-      ? `${url}${playlist.songs[0].image}`
+    return playlist.covers && playlist.covers.length > 0
+      ? `${url}${playlist.covers[0]}`
       : `${url}/media/songs/default-playlist.png`; // Custom default image for empty playlists
   };
 
+  // The playlist list only carries summaries: load the songs when playing
+  const handlePlayPlaylist = async (playlistId) => {
+    const token = localStorage.getItem('access_token');
+    try {
+      const response = await fetch(`${url}/api/playlists/${playlistId}/`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
+      if (!response.ok) return;
+      const playlist = await response.json();
+      if (playlist.songs.length > 0) {
+        const firstSong = playlist.songs[0];
+        playTrack({
+          id: firstSong.id,
+          title: firstSong.title,
+          artist: firstSong.artists?.map((a) => a.name).join(', ') || 'Unknown Artist',
+          cover: firstSong.image ? `${url}${firstSong.image}` : '/default-playlist.png',
+          file: `${url}${firstSong.audio_file}`,
+          duration: firstSong.duration,
+        });
+      }
+    } catch (error) {
+      console.error('Error playing playlist:', error);
+    }
+  };
+
   if (loading) {
     return (
       <div className="flex-1 bg-gradient-to-b from-gray-900 to-black p-6 flex items-center justify-center">
@@ -191,16 +234,8 @@ const Playlist = () => {
                   <button
                     onClick={(e) => {
                       e.stopPropagation();
-                      if (playlist.songs.length > 0) {
-                        const firstSong = playlist.songs[0];
-                        playTrack({
-                          id: firstSong.id,
-                          title: firstSong.title,
-                          artist: firstSong.artists?.map((a) => a.name).join(', ') || 'Unknown Artist',
-                          cover: firstSong.image ? `${url}${firstSong.image}` : '/default-playlist.png',
-                          file: `${url}${firstSong.audio_file}`,
-                          duration: firstSong.duration,
-                        });
+                      if (playlist.song_count > 0) {
+                        handlePlayPlaylist(playlist.id);
                       }
                     }}
                     className="absolute bottom-2 right-2 bg-green-500 rounded-full p-3 opacity-0 group-hover/item:opacity-100 transition hover:scale-105"
@@ -231,8 +266,7 @@ const Playlist = () => {
                     <button
                       onClick={(e) => {
                         e.stopPropagation();
-                        setEditPlaylistId(playlist.id);
-                        setIsSongModalOpen(true);
+                        openSongModal(playlist.id);
                       }}
                       className="text-[#B3B3B3] hover:text-[#1DB954]"
                     >
@@ -241,7 +275,7 @@ const Playlist = () => {
                   </div>
                 </div>
                 <h3 className="text-white font-medium truncate">{playlist.name}</h3>
-                <p className="text-gray-400 text-sm mt-1 truncate">{playlist.songs.length} songs</p>
+                <p className="text-gray-400 text-sm mt-1 truncate">{playlist.song_count} songs</p>
               </div>
             ))}
           </div>
@@ -328,8 +362,8 @@ const Playlist = () => {
               placeholder="Search songs or artists..."
             />
             <div className="max-h-60 overflow-y-auto space-y-2">
-              {getAvailableSongsForPlaylist(editPlaylistId).length > 0 ? (
-                getAvailableSongsForPlaylist(editPlaylistId).map((song) => (
+              {getAvailableSongsForPlaylist().length > 0 ? (
+                getAvailableSongsForPlaylist().map((song) => (
                   <div
                     key={song.id}
                     onClick={() => handleAddSong(editPlaylistId, song.id)}
@@ -250,18 +250,8 @@ function AdminAlbum() {
         // Case 1: Song list is unchanged
         toast.info(response.data.message);
       } else {
-        // Case 2: Song list updated
-        const updatedAlbum = { ...response.data, songs: response.data.songs || [] };
-        setAlbums(
-          albums.map((album) =>
-            album.id === addingSongsToAlbum.id ? updatedAlbum : album
-          )
-        );
-        setFilteredAlbums(
-          filteredAlbums.map((album) =>
-            album.id === addingSongsToAlbum.id ? updatedAlbum : album
-          )
-        );
+        // Case 2: Song list updated; the response is only a summary
+        // ({ album, song_count, added, removed }), the album itself is unchanged
         fetchSongs();
         toast.success("Cập nhật bài hát trong album thành công");
       }